@@ -4,7 +4,70 @@ Created on Tue Apr 17 13:59:30 2018
 
 @author: David
 """
-#GET SPECIFIC
-#MONTH, YEAR, SEASON
-#GET SERIES
-#MONTH, YEAR, SEASON
\ No newline at end of file
+import os
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from hidrots_periods import period_codes, period_labels # shared with completenessreport() in hidrots_1.4.py
+
+period_stats_names = ['mean', 'max', 'min', 'count']
+
+def period_select(data_df, period, code, codes = None):
+    """Returns the lines of a dataframe in one period group, i.e.: period_select(data_df, 'month', 200503).
+    codes is the period_codes() result for data_df.index(standard = None, computed here)"""
+    if codes is None:
+        codes = period_codes(data_df.index)
+    return data_df[codes[period] == code]
+
+def period_stats(data_df, period = 'month', columns = None, stats = None, quantiles = (), codes = None):
+    """
+    Computes grouped statistics of every collumn by period in a single pass, and returns a dataframe with one
+    line per period group and a (collumn, statistic) collumn for each collumn and statistic.
+    It uses:
+        1. A Pandas DataFrame with a DatetimeIndex - Using getts is suggested
+        2. The period: 'year', 'month', 'season', 'wateryear' or 'all'(standard = 'month')
+        3. A list with the collumn names(standard = None, all the collumns)
+        4. A list with statistics among 'mean', 'max', 'min', 'count' and 'sum'(standard = period_stats_names)
+        5. A list of quantiles between 0 and 1, named as 'q5', 'q50', 'q95'...(standard = no quantiles)
+        6. The period_codes() result for data_df.index(standard = None, computed here)
+    The lines are sorted by group once, and the sums, counts, maxima and minima of all the collumns come from
+    one reduction over the sorted values. Missing values are left out. Groups with no values get NaN
+    """
+    if columns is None:
+        columns = list(data_df.columns)
+    if stats is None:
+        stats = period_stats_names
+    if codes is None:
+        codes = period_codes(data_df.index)
+    group_codes = codes[period]
+    order = np.argsort(group_codes, kind = 'mergesort')
+    sorted_codes = group_codes[order]
+    values = data_df[columns].values.astype(float)[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    valid = np.isnan(values) == False
+    count = np.add.reduceat(valid.astype(int), starts, axis = 0)
+    total = np.add.reduceat(np.where(valid, values, 0.), starts, axis = 0)
+    results = {'count': count.astype(float), 'sum': total}
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        results['mean'] = total / count
+    results['max'] = np.fmax.reduceat(values, starts, axis = 0)
+    results['min'] = np.fmin.reduceat(values, starts, axis = 0)
+    names = list(stats)
+    arrays = [results[name] for name in stats]
+    if len(quantiles) > 0:
+        stops = np.r_[starts[1:], len(values)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            grouped = np.array([np.nanquantile(values[starts[k]:stops[k]], quantiles, axis = 0)
+                                for k in range(len(starts))])
+        for k in range(len(quantiles)):
+            names.append('q%g' % (quantiles[k] * 100))
+            arrays.append(grouped[:, k])
+    table = np.stack(arrays, axis = 2).reshape(len(starts), len(columns) * len(names))
+    stats_df = pd.DataFrame(table, index = period_labels(period, sorted_codes[starts]),
+                            columns = pd.MultiIndex.from_product([columns, names]))
+    stats_df.index.name = period
+    return stats_df
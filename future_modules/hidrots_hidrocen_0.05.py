@@ -6,6 +6,7 @@ Created on Wed Mar 28 12:17:48 2018
 """
 import numpy as np
 import matplotlib.pyplot as plt
+import multiprocessing
 
 monthly_file = r'D:/OneDrive/JZ_mensais.txt'
 annual_file = r'D:/OneDrive/JZ_sint_anual.txt'
@@ -86,4 +87,105 @@ def gethid_sen(monthly_file, annual_file):
     #CHECK IF IT WORKS !!!!!!!###
 	#DO FOR ALL YEARS INPUTTED#
 
-gethid_sen(monthly_file, annual_file)
\ No newline at end of file
+######################ENSEMBLE - MANY SYNTHETIC SERIES AT ONCE#####################################
+def ratio_limits(monthly_array):
+    """Returns the minimum and maximum ratios between the first month of a year and the last month of the
+    previous year in the historical monthly series (12 x years)"""
+    prev_q_ratio = monthly_array[0,1:]/monthly_array[11,:-1]
+    return np.min(prev_q_ratio), np.max(prev_q_ratio)
+
+def gethid_ensemble(monthly_array, annual_flows, n, seed = None):
+    """
+    Generates n synthetic monthly series at once with the hydrologic scenarios method used by gethid_sen().
+    Each year takes the monthly pattern (monthly flows over the annual mean) of a random historical year, scaled
+    by the annual flow. From the second year on, the pattern is drawn among the historical years whose first
+    month keeps the ratio to the previous December within the historical limits (see ratio_limits()). When no
+    year does, the one with the ratio closest to the limits is taken. It uses:
+        1. The historical monthly flows as an array (12 x historical years)
+        2. The annual flows of the synthetic years, as an array (years) used by all series or (n x years)
+        3. The number of synthetic series
+        4. A seed or a numpy Generator (standard = None, fresh random numbers)
+    Returns an array (n x years x 12). Candidates are tested for all series at once, with no loop over series
+    or candidates
+    """
+    rng = seed
+    if isinstance(rng, np.random.Generator) == False:
+        rng = np.random.default_rng(seed)
+    monthly_array = np.asarray(monthly_array, dtype = float)
+    annual_flows = np.asarray(annual_flows, dtype = float)
+    if annual_flows.ndim == 1:
+        annual_flows = np.tile(annual_flows, (n,1))
+    years = annual_flows.shape[1]
+    historical = monthly_array.shape[1]
+    ch = monthly_array/np.mean(monthly_array, axis=0)
+    min_prev_q_ratio, max_prev_q_ratio = ratio_limits(monthly_array)
+    series = np.arange(n)
+
+    sint_flows = np.empty((n, years, 12))
+    sorteio = rng.integers(0, historical, n)
+    sint_flows[:,0,:] = ch[:,sorteio].T * annual_flows[:,[0]]
+    for l in range(1, years):
+        prev_ratio_can = np.outer(annual_flows[:,l]/sint_flows[:,l-1,11], ch[0,:])
+        distance = np.maximum(min_prev_q_ratio - prev_ratio_can, prev_ratio_can - max_prev_q_ratio)
+        valid = distance < 0
+        raffle = rng.random((n, historical))
+        raffle[valid == False] = np.inf
+        chosen = np.argmin(raffle, axis = 1)
+        none_valid = valid.any(axis = 1) == False
+        chosen[none_valid] = np.argmin(distance[none_valid], axis = 1)
+        sint_flows[series,l,:] = ch[:,chosen].T * annual_flows[:,[l]]
+    return sint_flows
+
+######################ENSEMBLE - PARALLEL RUNS#####################################
+def gethid_parallel(monthly_array, annual_flows, n, output, seed = None, processes = None, blocksize = 1000,
+                    quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    Generates n synthetic monthly series with gethid_ensemble() in a pool of processes. It uses:
+        1-3. The same from gethid_ensemble()
+        4. The adress of the output .npy file, where all the series are written (n x years x 12)
+        5. A seed for the numpy SeedSequence (standard = None, fresh random numbers)
+        6. The number of processes (standard = None, one per processor)
+        7. The number of series per block (standard = 1000)
+        8. The quantiles to be returned
+    The series are split in blocks, each with its own random stream spawned from the SeedSequence, so the result
+    for a seed does not depend on the number of processes. Each worker writes its blocks straight to the output
+    file through a memory map. Returns an array (quantiles x 12) with the quantiles of the flows of each month
+    """
+    monthly_array = np.asarray(monthly_array, dtype = float)
+    annual_flows = np.asarray(annual_flows, dtype = float)
+    years = annual_flows.shape[-1]
+    sint_flows = np.lib.format.open_memmap(output, mode = 'w+', dtype = np.float64, shape = (n, years, 12))
+    del sint_flows
+    starts = list(range(0, n, blocksize))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    jobs = []
+    for k in range(len(starts)):
+        stop = min(starts[k] + blocksize, n)
+        block_flows = annual_flows
+        if annual_flows.ndim == 2:
+            block_flows = annual_flows[starts[k]:stop]
+        jobs.append((monthly_array, block_flows, starts[k], stop, seeds[k], output))
+    if processes == 1:
+        for job in jobs:
+            gethid_block(job)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            pool.map(gethid_block, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    sint_flows = np.load(output, mmap_mode = 'r')
+    return np.quantile(np.asarray(sint_flows).reshape(-1, 12), quantiles, axis = 0)
+
+def gethid_block(job):
+    """Generates one block of series for gethid_parallel() and writes it to the output file"""
+    monthly_array, annual_flows, start, stop, seed, output = job
+    block = gethid_ensemble(monthly_array, annual_flows, stop - start, seed = np.random.default_rng(seed))
+    sint_flows = np.load(output, mmap_mode = 'r+')
+    sint_flows[start:stop] = block
+    sint_flows.flush()
+    del sint_flows
+
+if __name__ == '__main__':
+    gethid_sen(monthly_file, annual_file)
\ No newline at end of file
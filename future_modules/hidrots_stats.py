@@ -29,26 +29,21 @@ def getts (fileinput = fileinput, index_col = indextime, indexparse = indexparse
     return df
 #################################PLOTTING CODE#######################
 def boxplot(df, flow_list, output = output, plot_tofile = True):
-    dfsample = df.dropna()
-    flow_lists = []
-    
-    for element in flowlist:
-        flow_temp = dfsample[element].tolist()
-        flow_lists.append(flow_temp)
-        
-        fig = plt.figure(1, figsize=(16, 12))
-        ax = fig.add_subplot(111)
-        ax.boxplot(flow_lists)
-        yticks = np.arange(0, 110, 2)
-        ax.set_yticks(yticks)
-        ax.set_title('Boxplot of Flows')
-        ax.set_xticklabels(flowlist, rotation=45, fontsize=12)
-        ax.grid(b= True)
-        if plot_tofile == True:
-            fig.savefig(boxplotout, bbox_inches='tight')
-            fig.show()
-
-df = getts()
-boxplot(df, flowlist, output = boxplotout, plot_tofile = True)
+    dfsample = df[flow_list].dropna()
+    flow_lists = [dfsample[element].values for element in flow_list]
 
+    fig = plt.figure(1, figsize=(16, 12))
+    ax = fig.add_subplot(111)
+    ax.boxplot(flow_lists)
+    yticks = np.arange(0, 110, 2)
+    ax.set_yticks(yticks)
+    ax.set_title('Boxplot of Flows')
+    ax.set_xticklabels(flow_list, rotation=45, fontsize=12)
+    ax.grid(b= True)
+    if plot_tofile == True:
+        fig.savefig(output, bbox_inches='tight')
+        fig.show()
 
+if __name__ == '__main__':
+    df = getts()
+    boxplot(df, flowlist, output = boxplotout, plot_tofile = True)
@@ -5,28 +5,333 @@ Created on Wed Apr 11 15:45:15 2018
 @author: David
 """
 import datetime
+import glob
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
 
 file = r'd:/output.rch'
 initial_date = datetime.date(2013, 1, 1)
 
-flows = []
-reaches = []
-dates = []
+rch_skiprows = 9 # header lines before the body of output.rch
+rch_chunksize = 500000 # body lines parsed at a time
+rch_cache_folder = os.path.join(os.path.expanduser('~'), '.hidrots_cache', 'swat') # apart from the getts() cache entries
+rch_cache_dtype = np.float32 # output.rch values have 4 significant digits
 
-from_file = open(file, 'r')
-lines = from_file.readlines()[9:]
-for i in lines:
-    line = i.split()
-    flows.append(line[6])
-    reaches.append(line[1])
+def rch_columns(filename):
+    """Returns the collumn names of an output.rch body. The first one is the 'REACH' label of every line"""
+    from_file = open(filename, 'r')
+    lines = [from_file.readline() for k in range(rch_skiprows)]
+    from_file.close()
+    return ['REACH'] + lines[-1].split()
 
-geral = [flows, reaches]
+def rch_chunks(filename, reaches = None, variables = None, chunksize = None):
+    """
+    Yields the body of a daily output.rch file in chunks, as (dataframe, day) pairs, where day holds the
+    number of the simulated day of every line, starting at 0. It uses the same arguments of readrch().
+    The dataframe has the RCH collumn and the selected variables
+    """
+    if chunksize is None:
+        chunksize = rch_chunksize
+    names = rch_columns(filename)
+    if variables is None:
+        variables = names[4:]
+    usecols = ['RCH', 'MON'] + list(variables)
+    reader = pd.read_csv(filename, sep = r'\s+', skiprows = rch_skiprows, header = None, names = names,
+                         usecols = usecols, chunksize = chunksize, dtype = {'MON': str})
+    last_mon = -np.inf # MON of the last day read
+    days = -1
+    for chunk in reader:
+        closing = chunk['MON'].str.contains('.', regex = False).values # the average annual block
+        mon = chunk['MON'].values.astype(float)
+        daily = mon <= 366
+        previous = np.r_[last_mon, mon[daily][:-1]]
+        ends = np.zeros(len(mon), dtype = bool)
+        ends[daily] = (mon[daily] < previous) & (mon[daily] != 1) # a drop without a new year
+        ends |= closing
+        finished = ends.any()
+        if finished:
+            stop = np.argmax(ends)
+            chunk, mon, daily = chunk[:stop], mon[:stop], daily[:stop]
+        chunk, mon = chunk[daily], mon[daily]
+        if len(chunk) > 0:
+            changes = np.ones(len(mon), dtype = int)
+            changes[1:] = mon[1:] != mon[:-1]
+            changes[0] = mon[0] != last_mon
+            day = days + np.cumsum(changes)
+            days = day[-1]
+            last_mon = mon[-1]
+            if reaches is not None:
+                selected = np.isin(chunk['RCH'].values, reaches)
+                chunk, day = chunk[selected], day[selected]
+            yield chunk.drop('MON', axis = 1), day
+        if finished:
+            break
+    reader.close()
 
-iterator = 0
-while iterator<len(flows):
-    datex = initial_date + datetime.timedelta(days=iterator)
-    dates.append(datex)
-    iterator = iterator+1
+def readrch(filename, initial_date, reaches = None, variables = None, chunksize = None):
+    """
+    Reads a daily SWAT output.rch file to a dataframe indexed by (Datahora, RCH), with one collumn per variable.
+    It uses:
+        1. The output.rch adress
+        2. The date of the first simulated day as datetime.date
+        3. A list with the reach numbers to be kept (standard = None, all the reaches)
+        4. A list with the variable names to be kept, i.e.: ['FLOW_OUTcms'] (standard = None, all)
+        5. The number of lines parsed at a time (standard = rch_chunksize)
+    The body is parsed in chunks by pandas, converted to numbers once, and only the selected reaches and
+    variables of each chunk are kept, so memory depends on the selection and not on the file size. The day
+    of a line comes from the MON collumn: a new day starts whenever it changes. Lines with MON above 366
+    (yearly summaries) are left out. The reading stops at the closing average annual block, whose MON is the
+    number of simulated years with a decimal point, or at any MON below the previous day other than a new
+    year's day 1. See rch_flows() for a getts() like dataframe
+    """
+    chunks = []
+    for chunk, day in rch_chunks(filename, reaches, variables, chunksize):
+        dates = np.datetime64(pd.Timestamp(initial_date).date(), 'D') + day.astype('timedelta64[D]')
+        chunk.insert(0, 'Datahora', dates.astype('datetime64[ns]'))
+        chunks.append(chunk)
+    rch_df = pd.concat(chunks, ignore_index = True)
+    return rch_df.set_index(['Datahora', 'RCH'])
 
-        
-        
\ No newline at end of file
+def rch_flows(rch_df, variable = 'FLOW_OUTcms'):
+    """Returns one variable of a readrch() dataframe with one collumn per reach, named as strings, and dates
+    as index, in the same layout of the getts() dataframes"""
+    flows_df = rch_df[variable].unstack('RCH')
+    flows_df.columns = [str(reach) for reach in flows_df.columns]
+    return flows_df
+
+##### Reach-major cache #####
+
+def rch_cache_path(filename):
+    """Returns the adresses of the (values, description) cache files of an output.rch in its current state,
+    or None if the file does not exist. The names start with the source key, so that the entries of older
+    states of the same file can be found(see rch_cache_clear())"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    source_key = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    state = '%s|%s' % (stat.st_mtime, stat.st_size)
+    state_key = hashlib.md5(state.encode('utf-8')).hexdigest()
+    base = os.path.join(rch_cache_folder, 'rch_%s_%s' % (source_key, state_key))
+    return base + '.npy', base + '_meta.npz'
+
+def rch_cache_clear(filename = None):
+    """Removes the cache entries of an output.rch, for all its states, or the whole SWAT cache if no file is
+    given. Entries still mapped by another process(on Windows) are left for a later call"""
+    source_key = '*'
+    if filename is not None:
+        source_key = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    for path in glob.glob(os.path.join(rch_cache_folder, 'rch_%s_*.np[yz]' % source_key)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def rch_cache_build(filename, initial_date, variables = None, chunksize = None):
+    """
+    Parses an output.rch once and stores its values reach-major, as an array of shape (variables, reaches, days)
+    in a .npy file, so the series of one reach and variable is one contiguous block of the file.
+    It uses:
+        1. The output.rch adress
+        2. The date of the first simulated day as datetime.date
+        3. A list with the variable names to be stored (standard = None, all)
+        4. The number of lines parsed at a time (standard = rch_chunksize)
+    The text file is read twice: once for the reach numbers and the number of days, and once for the values,
+    which are written straight to the memory mapped cache. The entries of older runs written to the same adress
+    are removed first. Returns the same as rch_cache_load()
+    """
+    paths = rch_cache_path(filename)
+    if paths is None:
+        raise IOError('File %s not found' % filename)
+    if variables is None:
+        variables = rch_columns(filename)[4:]
+    variables = list(variables)
+    reaches = np.array([], dtype = int)
+    days = 0
+    for chunk, day in rch_chunks(filename, variables = [], chunksize = chunksize):
+        reaches = np.union1d(reaches, chunk['RCH'].values)
+        days = int(day[-1]) + 1
+    if not os.path.isdir(rch_cache_folder):
+        os.makedirs(rch_cache_folder)
+    rch_cache_clear(filename)
+    values = np.lib.format.open_memmap(paths[0], mode = 'w+', dtype = rch_cache_dtype,
+                                       shape = (len(variables), len(reaches), days))
+    values[:] = np.nan
+    for chunk, day in rch_chunks(filename, variables = variables, chunksize = chunksize):
+        positions = np.searchsorted(reaches, chunk['RCH'].values)
+        for k in range(len(variables)):
+            values[k, positions, day] = chunk[variables[k]].values
+    values.flush()
+    del values
+    np.savez(paths[1], reaches = reaches, variables = np.array(variables),
+             start = np.array(str(pd.Timestamp(initial_date).date())))
+    return rch_cache_load(filename)
+
+def rch_cache_load(filename):
+    """Returns (values, reaches, variables, dates) from the cache of an output.rch, with values as a read only
+    memory map of shape (variables, reaches, days), or None when there is no valid cache for the file"""
+    paths = rch_cache_path(filename)
+    if paths is None or os.path.isfile(paths[0]) == False or os.path.isfile(paths[1]) == False:
+        return None
+    try:
+        values = np.load(paths[0], mmap_mode = 'r')
+        meta = np.load(paths[1], allow_pickle = False)
+    except (IOError, ValueError):
+        return None
+    try:
+        reaches = meta['reaches']
+        variables = [str(v) for v in meta['variables']]
+        dates = pd.date_range(str(meta['start']), periods = values.shape[2], freq = 'D', name = 'Datahora')
+    finally:
+        meta.close()
+    return values, reaches, variables, dates
+
+def rch_series(filename, reach, variable = 'FLOW_OUTcms', initial_date = None):
+    """
+    Returns the series of one reach and variable as a dataframe with one collumn named as the reach, in the
+    same layout of the getts() dataframes, so it can be sent to hsprinter() or sep_straight().
+    It uses:
+        1. The output.rch adress
+        2. The reach number
+        3. The variable name (standard = 'FLOW_OUTcms')
+        4. The date of the first simulated day as datetime.date, only needed if the cache must be built
+    The values come from a single slice of the memory mapped cache, which is built on the first call
+    """
+    cached = rch_cache_load(filename)
+    if cached is None or variable not in cached[2]:
+        if initial_date is None:
+            raise ValueError('No cache for %s. The initial date is needed to build it' % filename)
+        cached = rch_cache_build(filename, initial_date)
+    values, reaches, variables, dates = cached
+    position = np.searchsorted(reaches, reach)
+    if position == len(reaches) or reaches[position] != reach:
+        raise KeyError('Reach %s not found in %s' % (reach, filename))
+    series = np.array(values[variables.index(variable), position], dtype = float)
+    return pd.DataFrame({str(reach): series}, index = dates)
+
+def test_readrch():
+    """Tests readrch() and the cache on test/output_example.rch, a trimmed output.rch with 5 days of 2 reaches, two
+    yearly summaries and the closing average annual block(MON = 1.0). Only the 5 days must be read, for any
+    chunk size, and the cache must give the same series"""
+    cwd = os.getcwd()
+    test_folder = os.path.join(cwd,r'test')
+    fileinput = os.path.join(test_folder,'output_example.rch')
+    expected = pd.DataFrame({'1': [1.1, 1.0, 4.8, 2.5, 1.8], '2': [3.3, 3.2, 7.7, 5.0, 4.1]},
+                            index = pd.date_range('2012-12-30', periods = 5, freq = 'D'))
+    msg = """The output.rch reader is not working properly. Please contact the Administrator or obtain a stable version"""
+    for chunksize in [1, 2, 3, 5, 100]:
+        flows_df = rch_flows(readrch(fileinput, datetime.date(2012, 12, 30), chunksize = chunksize))
+        assert list(flows_df.columns) == ['1', '2'], msg
+        assert (flows_df.index == expected.index).all(), msg
+        assert np.allclose(flows_df.values, expected.values), msg
+    flows_df = rch_flows(readrch(fileinput, datetime.date(2012, 12, 30), reaches = [2]))
+    assert list(flows_df.columns) == ['2'] and np.allclose(flows_df['2'].values, expected['2'].values), msg
+    msg = """The output.rch cache is not working properly. Please contact the Administrator or obtain a stable version"""
+    rch_cache_clear(fileinput)
+    try:
+        for reach in [1, 2]:
+            series_df = rch_series(fileinput, reach, initial_date = datetime.date(2012, 12, 30))
+            assert (series_df.index == expected.index).all(), msg
+            assert np.allclose(series_df[str(reach)].values, expected[str(reach)].values), msg
+        assert rch_cache_load(fileinput) is not None, msg
+    finally:
+        rch_cache_clear(fileinput)
+    assert rch_cache_load(fileinput) is None, msg
+
+##### Simulated x observed #####
+
+def fit_metrics(simulated, observed):
+    """
+    Returns NSE, KGE, PBIAS(%) and RMSE for every collumn pair of two (days x pairs) arrays, in one
+    vectorized pass. Days missing in either array are left out of the pair. PBIAS is positive when the
+    model underestimates the observed volume. Pairs with less than two valid days get NaN.
+    Returns a (pairs x 5) array with the collumns NSE, KGE, PBIAS, RMSE and the number of valid days
+    """
+    simulated = np.asarray(simulated, dtype = float)
+    observed = np.asarray(observed, dtype = float)
+    valid = ~(np.isnan(simulated) | np.isnan(observed))
+    count = valid.sum(axis = 0)
+    sim = np.where(valid, simulated, 0.)
+    obs = np.where(valid, observed, 0.)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        sim_mean = sim.sum(axis = 0) / count
+        obs_mean = obs.sum(axis = 0) / count
+        sim_dev = np.where(valid, sim - sim_mean, 0.)
+        obs_dev = np.where(valid, obs - obs_mean, 0.)
+        sim_sd = np.sqrt((sim_dev ** 2).sum(axis = 0) / count)
+        obs_sd = np.sqrt((obs_dev ** 2).sum(axis = 0) / count)
+        squared_error = ((sim - obs) ** 2).sum(axis = 0)
+        nse = 1. - squared_error / (obs_dev ** 2).sum(axis = 0)
+        r = (sim_dev * obs_dev).sum(axis = 0) / count / (sim_sd * obs_sd)
+        kge = 1. - np.sqrt((r - 1.) ** 2 + (sim_sd / obs_sd - 1.) ** 2 + (sim_mean / obs_mean - 1.) ** 2)
+        pbias = 100. * (obs - sim).sum(axis = 0) / obs.sum(axis = 0)
+        rmse = np.sqrt(squared_error / count)
+    metrics = np.column_stack([nse, kge, pbias, rmse, count])
+    metrics[count < 2, :4] = np.nan
+    return metrics
+
+def fit_metrics_worker(job):
+    """Runs fit_metrics() on one block of pairs for rch_compare()"""
+    simulated, observed = job
+    return fit_metrics(simulated, observed)
+
+def rch_compare(filename, observed_df, mapping, variable = 'FLOW_OUTcms', initial_date = None, processes = 1,
+                blocksize = 500):
+    """
+    Compares simulated reaches with observed gauges and returns one line per pair with NSE, KGE, PBIAS, RMSE
+    and the number of days used.
+    It uses:
+        1. The output.rch adress. The simulated series come from its reach-major cache(see rch_cache_build())
+        2. A Pandas DataFrame with the observed flows - Using getts is suggested
+        3. The mapping table, as a dict {gauge collumn: reach number} or a dataframe with the collumns 'gauge'
+        and 'reach'. A gauge or reach may appear in many pairs
+        4. The simulated variable name (standard = 'FLOW_OUTcms')
+        5. The date of the first simulated day as datetime.date, only needed if the cache must be built
+        6. The number of processes(standard = 1, one vectorized pass. None is one per processor)
+        7. The number of pairs per job when processes is not 1 (standard = 500)
+    Only the dates in both the simulation and observed_df are compared. Observed sub-daily dates are not
+    resampled, so observed_df should be daily
+    """
+    if isinstance(mapping, dict):
+        mapping = pd.DataFrame({'gauge': list(mapping.keys()), 'reach': list(mapping.values())})
+    gauges = [str(g) for g in mapping['gauge']]
+    pair_reaches = np.asarray(mapping['reach'], dtype = int)
+    cached = rch_cache_load(filename)
+    if cached is None or variable not in cached[2]:
+        if initial_date is None:
+            raise ValueError('No cache for %s. The initial date is needed to build it' % filename)
+        cached = rch_cache_build(filename, initial_date)
+    values, reaches, variables, dates = cached
+    positions = np.searchsorted(reaches, pair_reaches)
+    missing = (positions == len(reaches)) | (reaches[np.minimum(positions, len(reaches) - 1)] != pair_reaches)
+    if missing.any():
+        raise KeyError('Reaches %s not found in %s' % (list(pair_reaches[missing]), filename))
+    observed_df = observed_df.copy()
+    observed_df.columns = [str(c) for c in observed_df.columns]
+    common = dates.intersection(observed_df.index)
+    days = dates.get_indexer(common)
+    simulated = np.asarray(values[variables.index(variable)][positions][:, days], dtype = float).T
+    observed = observed_df.loc[common, gauges].values.astype(float)
+    if processes == 1:
+        metrics = fit_metrics(simulated, observed)
+    else:
+        jobs = [(simulated[:, k:k + blocksize], observed[:, k:k + blocksize])
+                for k in range(0, len(gauges), blocksize)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            metrics = np.concatenate(pool.map(fit_metrics_worker, jobs, chunksize = 1))
+        finally:
+            pool.close()
+            pool.join()
+    results_df = pd.DataFrame(metrics, columns = ['NSE', 'KGE', 'PBIAS', 'RMSE', 'days'])
+    results_df.insert(0, 'reach', pair_reaches)
+    results_df.insert(0, 'gauge', gauges)
+    results_df['days'] = results_df['days'].astype(int)
+    return results_df
+
+if __name__ == '__main__':
+    rch_df = readrch(file, initial_date, variables = ['FLOW_OUTcms'])
+    flows_df = rch_flows(rch_df)
@@ -8,6 +8,8 @@ Description: Program for time series analysis. It has 3 modules
     3) missingreport: Prints on a pre-loaded matplotlib figure the periods where the data exists
     4) sep_stright: Prints on a pre-loaded matplotlib figure the baseflow hydrograph using the straight 
        line method. It uses a nx2 dataframe. Series may have any timestep.
+    Run without arguments for the interactive menu, or with a job file adress and optionally a number of
+    processes for batch mode(see batch_run() and Input_batch.txt)
 @author: David Bispo Ferreira // Federal University of Parana
 """
 import matplotlib 
@@ -18,11 +20,31 @@ import math
 import numpy as np 
 import sys
 import os
+import glob
+import hashlib
+import io
+import multiprocessing
+import collections
+import time
+from hidrots_periods import hydro_seasons, wateryear_start, period_codes, period_labels
 
 ans_select_output = None
+cache_folder = os.path.join(os.path.expanduser('~'), '.hidrots_cache')
+cache_maxsize = 1024 * 1024 * 1024 # bytes. Older cache files are removed above this size
+cache_autoprune = True # cache_save() prunes the cache after each entry. Off in getts_many() workers
+rainfall_dtype = np.float32 # dtype for rainfall collumns fetched by the menus
+event_chunksize = 50000 # rows per chunk when the runoff separation menu fetches its limits
+offsets_step = 1000 # rows between two entries of the byte offsets index
+offsets_blocksize = 64 * 1024 * 1024 # bytes read at a time while building the byte offsets index
+session_maxsize = 512 * 1024 * 1024 # bytes of dataframes kept in memory by df_parser()
+session_frames = collections.OrderedDict() # loaded dataframes, least recently used first
+volume_unit = 'm3' # unit of runoff volumes: flows in cms integrated over seconds
+dateformats = ['%m/%d/%Y %H:%M', '%d/%m/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%m/%d/%Y', '%d/%m/%Y',
+               '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'] # candidates for detect_dateformat()
 ####################################   TIME SERIES READER   ############################
 
-def getts (filename, index_col, indexparse, separator, limits):
+def getts (filename, index_col, indexparse, separator, limits, cache = True, dateformat = None, validate = False,
+           columns = None, dtype = None, chunksize = None, offsets = False):
     """
     Gets a timeseries in a Pandas dataframe. The module uses date parsing based on collumn names. 
     Module arguments are:
@@ -35,14 +57,172 @@ def getts (filename, index_col, indexparse, separator, limits):
         a spreadsheet application(i.e.: MS Excel(r))
         5. The lower limits to be fetched by the application. The input must be a Python datetime Object. If you don't know what
         that is, I suggest you look it up
-        6. The lower limits to be fetched by the application. Same thing from (5) applies.
+        6. The lower limits to be fetched by the application. Same thing from (5) applies. If limits is None, the whole
+        file is fetched
+        7. An optional boolean for the on-disk cache(standard = True). When the source file did not change
+        since the last call, the parsed dataframe is loaded from the cache folder instead of parsing the
+        csv again. See cache_load() and cache_clear()
+        8. An optional strptime format for the index collumn as String, i.e.: '%m/%d/%Y %H:%M'. The whole collumn
+        is then parsed in a single pass with that format instead of inferring it. Use 'auto' to detect the format
+        from the first rows of the file(see detect_dateformat()). If None(standard), dates are inferred
+        9. An optional boolean for date validation(standard = False). Only used with a dateformat. Case positive,
+        the rows that do not match the format are reported and left out of the dataframe. Case negative, a row
+        that does not match raises a ValueError
+        10. An optional list with the names of the collumns to be fetched as String. Other collumns are not
+        parsed. If None(standard), all collumns are fetched. Names that are not in the file are reported like any other
+        wrong key. See getts_columns() to list the collumns of a file
+        11. An optional dtype for the fetched collumns, i.e.: np.float32, or a dict with one dtype per collumn
+        name. If None(standard), pandas chooses it(float64 for numbers). With the cache on, values are cached in
+        full precision and converted afterwards
+        12. An optional number of rows for reading the file in chunks(standard = None). Chunks before the lower
+        limit are skipped and the reading stops at the first chunk after the upper limit, so only the rows
+        close to the limits are parsed. Files with unsorted dates are fetched as a whole. See getts_window()
+        13. An optional boolean for the byte offsets index(standard = False). Case positive, an index from dates to
+        positions in the file is built on the first call and kept in the cache folder. The rows within the limits are
+        then read directly from their position in the file. Files with unsorted dates are fetched as a whole.
+        See getts_seek()
         """    
     try:
-        data_df = pd.read_csv(filename, index_col = index_col, sep = separator , parse_dates = indexparse, infer_datetime_format = True)
-        data_df = data_df.loc['%s'%(limits[0]):'%s'%(limits[1])]
+        usecols = None
+        if columns is not None:
+            header = getts_columns(filename, index_col, separator)
+            unknown = [name for name in columns if name not in header]
+            if len(unknown) > 0:
+                print('Warning: the collumns %s are not in %s' % (', '.join([str(name) for name in unknown]), filename))
+                raise KeyError(unknown)
+            columns = [name for name in header if name in columns]
+            usecols = [index_col] + columns
+        readtype = {}
+        if dtype is not None:
+            if isinstance(dtype, dict):
+                readtype = dict(dtype)
+            else:
+                for name in (columns or getts_columns(filename, index_col, separator)):
+                    readtype[name] = dtype
+        data_df = None
+        if offsets == True and limits is not None:
+            data_df = getts_seek(filename, index_col, separator, limits, dateformat = dateformat, validate = validate,
+                                 usecols = usecols, dtype = dict(readtype))
+        if data_df is None and cache == True:
+            data_df = cache_load(filename, index_col, separator, columns, dateformat = dateformat, validate = validate)
+        if data_df is None:
+            if chunksize is not None and limits is not None:
+                data_df = getts_window(filename, index_col, separator, limits, chunksize, dateformat = dateformat,
+                                       validate = validate, usecols = usecols, dtype = dict(readtype))
+        if data_df is None:
+            if cache == True:
+                readtype = {}
+            if dateformat is None:
+                data_df = pd.read_csv(filename, index_col = index_col, sep = separator , parse_dates = indexparse, infer_datetime_format = True,
+                                      usecols = usecols, dtype = readtype or None)
+            else:
+                readtype[index_col] = str
+                data_df = pd.read_csv(filename, index_col = index_col, sep = separator, dtype = readtype, usecols = usecols)
+                data_df.index = parse_dateindex(data_df.index, dateformat, validate)
+                data_df = data_df[data_df.index.notnull()]
+            if cache == True:
+                cache_save(data_df, filename, index_col, separator, complete = columns is None, dateformat = dateformat,
+                           validate = validate)
+        if dtype is not None:
+            data_df = data_df.astype(dtype)
+        if limits is not None:
+            data_df = data_df.loc['%s'%(limits[0]):'%s'%(limits[1])]
         return data_df
     except KeyError:
        print "Warning","Your keys are incorrect. Please review your csv file."
+
+def getts_window(filename, index_col, separator, limits, chunksize, dateformat = None, validate = False, usecols = None, dtype = None):
+    """Reads only the part of a file with sorted dates that is needed for the limits, in chunks of chunksize rows.
+    The arguments are the same from getts(). For each chunk only the first and last dates are parsed before
+    deciding if it is needed: chunks that end before limits[0] are skipped and the reading stops at the first chunk
+    that starts after limits[1]. Returns None if the dates are found not to be ascending, so that the caller
+    fetches the whole file instead. If dateformat is None or 'auto', it is detected from the first chunk. None is also
+    returned when it can not be detected or a later chunk does not match it"""
+    lower = pd.Timestamp('%s' % (limits[0]))
+    upper = pd.Timestamp('%s' % (limits[1])) + pd.Timedelta(days = 1) # '%s' slicing of a date includes the whole day
+    readtype = dict(dtype or {})
+    readtype[index_col] = str
+    reader = pd.read_csv(filename, index_col = index_col, sep = separator, dtype = readtype, usecols = usecols, chunksize = chunksize)
+    chunks = []
+    last_date = None
+    if dateformat == 'auto':
+        dateformat = None
+    detected = dateformat is None
+    for chunk in reader:
+        if len(chunk) == 0:
+            continue
+        if dateformat is None:
+            dateformat = detect_dateformat(chunk.index)
+            if dateformat is None:
+                reader.close()
+                return None
+        try:
+            edges = pd.to_datetime([chunk.index[0], chunk.index[-1]], format = dateformat)
+            if (last_date is not None and edges[0] < last_date) or edges[-1] < edges[0]:
+                reader.close()
+                return None
+            last_date = edges[-1]
+            if edges[-1] < lower:
+                continue
+            if edges[0] > upper:
+                break
+            chunk.index = parse_dateindex(chunk.index, dateformat, validate)
+        except ValueError:
+            if detected == False:
+                raise
+            reader.close()
+            return None
+        chunk = chunk[chunk.index.notnull()]
+        if chunk.index.is_monotonic_increasing == False:
+            reader.close()
+            return None
+        chunks.append(chunk)
+    reader.close()
+    if len(chunks) == 0:
+        return pd.read_csv(filename, index_col = index_col, sep = separator, dtype = readtype, usecols = usecols, nrows = 0).set_index(
+            pd.DatetimeIndex([], name = index_col))
+    return pd.concat(chunks)
+
+def getts_seek(filename, index_col, separator, limits, dateformat = None, validate = False, usecols = None, dtype = None):
+    """Reads only the rows within the limits from a file with sorted dates, seeking their position through the byte
+    offsets index(see offsets_build()). The arguments are the same from getts(). The index is built on the first call
+    and reused while the file does not change. Returns None if the file dates are not ascending, so that the caller
+    fetches the whole file instead"""
+    path = offsets_path(filename, index_col, separator)
+    if path is None:
+        return None
+    if os.path.isfile(path) == False:
+        offsets_build(filename, index_col, separator)
+    if os.path.isfile(path) == False:
+        return None
+    times, positions = np.load(path)
+    lower = pd.Timestamp('%s' % (limits[0])).value
+    upper = (pd.Timestamp('%s' % (limits[1])) + pd.Timedelta(days = 1)).value # '%s' slicing of a date includes the whole day
+    first = max(np.searchsorted(times, lower, side = 'left') - 1, 0)
+    last = np.searchsorted(times, upper, side = 'right')
+    with open(filename, 'rb') as source:
+        header = source.readline()
+        source.seek(positions[first])
+        if last < len(positions):
+            body = source.read(positions[last] - positions[first])
+        else:
+            body = source.read()
+    readtype = dict(dtype or {})
+    readtype[index_col] = str
+    data_df = pd.read_csv(io.BytesIO(header + body), index_col = index_col, sep = separator, dtype = readtype, usecols = usecols)
+    if dateformat is None:
+        dateformat = detect_dateformat(data_df.index)
+    if dateformat is None:
+        data_df.index = pd.DatetimeIndex(pd.to_datetime(data_df.index), name = index_col)
+    else:
+        data_df.index = parse_dateindex(data_df.index, dateformat, validate)
+        data_df = data_df[data_df.index.notnull()]
+    return data_df
+
+def getts_columns(filename, index_col, separator):
+    """Returns the names of the collumns in a file, except the index collumn, without fetching any rows"""
+    header_df = pd.read_csv(filename, index_col = index_col, sep = separator, nrows = 0)
+    return [str(name) for name in header_df.columns]
        
 def test_getts():
     """Tests the getts function, by calling a pre-loaded file, and verifying the values in certain rows and collumns
@@ -60,6 +240,399 @@ def test_getts():
     contact the developer or get a stable copy of the program"""
     assert success, msg
 
+def detect_dateformat(dates, nrows = 100):
+    """Detects the format of a date collumn among the dateformats list. It uses:
+        1. A list, array or pandas Index with dates as strings
+        2. The number of rows to be tested, from the beginning of the collumn(standard = 100)
+    A format is a candidate when all the tested rows match it. When more than one format matches(i.e.: day and
+    month are both below 13 in the tested rows), the whole collumn is parsed with each candidate and the ties are
+    broken by:
+        a. the fewest rows that do not match(i.e.: a day above 12 rules out the month first formats)
+        b. ascending dates, then the fewest distinct timesteps(a month first reading of day first hourly data
+        jumps one month at each new day)
+    If the candidates are still tied and read the collumn differently, the ambiguity is reported and None is
+    returned, so the format must be provided. Returns None if no format matches"""
+    sample = pd.Series(dates[:nrows]).dropna().astype(str)
+    matches = []
+    for dateformat in dateformats:
+        parsed = pd.to_datetime(sample, format = dateformat, errors = 'coerce')
+        if len(sample) > 0 and parsed.isnull().any() == False:
+            matches.append(dateformat)
+    if len(matches) < 2:
+        return (matches or [None])[0]
+    column = pd.Series(np.asarray(dates, dtype = object)).dropna().astype(str)
+    scores = []
+    readings = []
+    for dateformat in matches:
+        parsed = pd.to_datetime(column, format = dateformat, errors = 'coerce')
+        steps = parsed.dropna().diff().dropna()
+        scores.append((int(parsed.isnull().sum()), (steps < pd.Timedelta(0)).any(), steps.nunique()))
+        readings.append(parsed)
+    best = [k for k in range(len(matches)) if scores[k] == min(scores)]
+    for k in best[1:]:
+        if readings[k].equals(readings[best[0]]) == False:
+            print('Warning: the dates match more than one format(%s). Please provide the format'
+                  % (', '.join([matches[j] for j in best])))
+            return None
+    return matches[best[0]]
+
+def parse_dateindex(dates, dateformat, validate = False):
+    """Parses a date collumn in a single vectorized pass with a fixed format and returns a DatetimeIndex.
+    If dateformat is 'auto', the format is detected with detect_dateformat(). With validate = True the dates
+    that do not match the format are printed as a report(see dateindex_report()) and parsed as NaT"""
+    name = getattr(dates, 'name', None)
+    if dateformat == 'auto':
+        dateformat = detect_dateformat(dates)
+        if dateformat is None:
+            raise ValueError('The date format could not be detected. Please provide it')
+    if validate == False:
+        return pd.DatetimeIndex(pd.to_datetime(dates, format = dateformat), name = name)
+    parsed = pd.DatetimeIndex(pd.to_datetime(dates, format = dateformat, errors = 'coerce'), name = name)
+    report = dateindex_report(dates, parsed)
+    if len(report) > 0:
+        print('Warning: %d rows do not match the date format %s' % (len(report), dateformat))
+        print(report.head(20).to_string())
+    return parsed
+
+def dateindex_report(dates, parsed):
+    """Returns a dataframe with the row number and the original value of the dates that failed parsing"""
+    dates = pd.Series(np.asarray(dates, dtype = object))
+    failed = np.asarray(pd.isnull(parsed)) & dates.notnull().values
+    rows = np.flatnonzero(failed)
+    return pd.DataFrame({'row': rows, 'value': dates.values[rows]}, columns = ['row', 'value'])
+
+####################################   TIME SERIES CACHE   ############################
+# Parsed dataframes are saved as .npz files in cache_folder, one array per collumn plus the index as
+# int64 nanoseconds. The file name is built from the source adress, so that all the entries from a source
+# can be found, and from the source mtime, size and reading options, so that a changed file is never
+# served from an old entry.
+
+def cache_path(filename, index_col, separator, dateformat = None, validate = False):
+    """Returns the cache file adress for a source file in its current state and date parsing options(see getts()),
+    or None if the file does not exist"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    source_key = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    state = '%s|%s|%s|%s|%s|%s' % (stat.st_mtime, stat.st_size, index_col, separator, dateformat, validate)
+    state_key = hashlib.md5(state.encode('utf-8')).hexdigest()
+    return os.path.join(cache_folder, '%s_%s.npz' % (source_key, state_key))
+
+def cache_load(filename, index_col, separator, columns = None, dateformat = None, validate = False):
+    """Returns the cached dataframe for a source file, or None when the cache has no valid entry for it.
+    If a list of columns is given only those arrays are read from the entry. Entries are only shared by calls
+    with the same dateformat and validate options"""
+    path = cache_path(filename, index_col, separator, dateformat, validate)
+    if path is None or os.path.isfile(path) == False:
+        return None
+    try:
+        cached = np.load(path, allow_pickle = False)
+    except (IOError, ValueError):
+        return None
+    try:
+        cached_columns = [str(c) for c in cached['columns']]
+        if columns is None and bool(cached['complete']) == False:
+            return None
+        if columns is None:
+            columns = cached_columns
+        if set(columns).issubset(cached_columns) == False:
+            return None
+        index = pd.DatetimeIndex(cached['index'].astype('datetime64[ns]'), name = index_col)
+        data = {}
+        for name in columns:
+            data[name] = cached['c%d' % (cached_columns.index(name))]
+    except KeyError:
+        return None
+    finally:
+        cached.close()
+    os.utime(path, None) # marks the entry as recently used for cache_prune()
+    return pd.DataFrame(data, index = index, columns = columns)
+
+def cache_save(data_df, filename, index_col, separator, complete = True, dateformat = None, validate = False):
+    """Saves a parsed dataframe to the cache. Dataframes without a datetime index or with non numeric
+    collumns are not cached. Older entries from the same source are removed. complete tells if the
+    dataframe holds all the collumns of the source"""
+    path = cache_path(filename, index_col, separator, dateformat, validate)
+    if path is None or isinstance(data_df.index, pd.DatetimeIndex) == False:
+        return
+    arrays = {'index': data_df.index.values.astype('datetime64[ns]').astype(np.int64),
+              'columns': np.array([str(c) for c in data_df.columns]), 'complete': np.array(complete)}
+    for k in range(len(data_df.columns)):
+        values = data_df.iloc[:, k].values
+        if values.dtype.kind not in 'biuf':
+            return
+        arrays['c%d' % (k)] = values
+    if os.path.isdir(cache_folder) == False:
+        os.makedirs(cache_folder)
+    cache_clear(filename, extension = '.npz')
+    temp_path = path[:-4] + '_tmp.npz'
+    np.savez(temp_path, **arrays)
+    os.rename(temp_path, path)
+    if cache_autoprune == True:
+        cache_prune()
+
+def cache_clear(filename = None, extension = None):
+    """Invalidates the cache. Removes every entry from a source file or, if no file is given, the
+    whole cache folder content. extension limits the removal to dataframes('.npz') or byte offsets
+    indexes('.npy'). If None(standard), both are removed"""
+    source_key = '*'
+    if filename is not None:
+        source_key = hashlib.md5(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    extensions = ['.npz', '.npy']
+    if extension is not None:
+        extensions = [extension]
+    for extension in extensions:
+        for path in glob.glob(os.path.join(cache_folder, '%s_*%s' % (source_key, extension))):
+            if path.endswith('_tmp.npz'):
+                continue # being written by another process
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def cache_prune(maxsize = None):
+    """Removes the least recently used cache entries until the cache folder is below maxsize bytes
+    (standard = cache_maxsize)"""
+    if maxsize is None:
+        maxsize = cache_maxsize
+    entries = []
+    for path in glob.glob(os.path.join(cache_folder, '*.np[yz]')):
+        if path.endswith('_tmp.npz'):
+            continue # being written by another process
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue # removed by another process
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum([entry[1] for entry in entries])
+    for mtime, size, path in entries:
+        if total <= maxsize:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total = total - size
+
+def test_cache():
+    """Tests the on-disk cache with a copy of the test file: a parsed file must come back the same from the cache,
+    whole or by collumns, and a changed file must not be served from its old entry. The copy and its entries are
+    removed at the end"""
+    cwd = os.getcwd()
+    test_folder = os.path.join(cwd,r'test')
+    source = open(os.path.join(test_folder,'Planilha_mestra.csv'), 'r')
+    text = source.read()
+    source.close()
+    fileinput = os.path.join(test_folder,'cache_test.csv')
+    msg = """Your cache is not working properly. Please contact the Administrator or obtain a stable version"""
+    try:
+        copy = open(fileinput, 'w')
+        copy.write(text)
+        copy.close()
+        cache_clear(fileinput)
+        assert cache_load(fileinput, 'Datahora', ',') is None, msg
+        data_df = getts(fileinput, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = None)
+        assert cache_load(fileinput, 'Datahora', ',').equals(data_df), msg
+        cached_df = getts(fileinput, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = None)
+        assert cached_df.equals(data_df), msg
+        assert cache_load(fileinput, 'Datahora', ',', columns = ['Simepar']).equals(data_df[['Simepar']]), msg
+        assert cache_load(fileinput, 'Datahora', ',', dateformat = '%m/%d/%Y %H:%M') is None, msg
+        old_entry = cache_path(fileinput, 'Datahora', ',')
+        copy = open(fileinput, 'a')
+        copy.write('1/1/2018 0:00,1,2,3,4,5,6,7,8,9,10\n')
+        copy.close()
+        assert cache_load(fileinput, 'Datahora', ',') is None, msg
+        changed_df = getts(fileinput, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = None)
+        assert len(changed_df) == len(data_df) + 1 and changed_df['Tmd_vaz'].iloc[-1] == 10, msg
+        assert os.path.isfile(old_entry) == False, msg
+        assert cache_load(fileinput, 'Datahora', ',').equals(changed_df), msg
+    finally:
+        cache_clear(fileinput)
+        if os.path.isfile(fileinput):
+            os.remove(fileinput)
+
+####################################   SESSION CACHE   ############################
+# Whole dataframes loaded by df_parser() stay in memory, so that the menus only slice them when the limits change.
+# Entries are kept in session_frames from the least to the most recently used and the oldest ones are dropped
+# above session_maxsize. Files larger than session_maxsize are never kept and are read with the limits instead.
+
+def session_key(filename, header, columns, dtype):
+    """Returns the session_frames key for a file and its reading options"""
+    if isinstance(dtype, dict):
+        dtype = tuple(sorted([(name, np.dtype(dtype[name]).str) for name in dtype]))
+    elif dtype is not None:
+        dtype = np.dtype(dtype).str
+    if columns is not None:
+        columns = tuple(columns)
+    return (os.path.abspath(filename), header, columns, dtype)
+
+def session_load(filename, header, columns = None, dtype = None):
+    """Returns a dataframe kept in memory for a file and its reading options, or None. Entries from a file that
+    changed since they were loaded are dropped"""
+    key = session_key(filename, header, columns, dtype)
+    if key not in session_frames:
+        return None
+    state, data_df = session_frames.pop(key)
+    stat = os.stat(filename)
+    if state != (stat.st_mtime, stat.st_size):
+        return None
+    session_frames[key] = (state, data_df) # moves the entry to the most recently used end
+    return data_df
+
+def session_save(data_df, filename, header, columns = None, dtype = None):
+    """Keeps a dataframe in memory and drops the least recently used ones above session_maxsize"""
+    if data_df is None:
+        return
+    stat = os.stat(filename)
+    key = session_key(filename, header, columns, dtype)
+    session_frames.pop(key, None)
+    session_frames[key] = ((stat.st_mtime, stat.st_size), data_df)
+    total = sum([frame.memory_usage(index = True).sum() for state, frame in session_frames.values()])
+    while total > session_maxsize and len(session_frames) > 0:
+        state, frame = session_frames.pop(next(iter(session_frames)))
+        total = total - frame.memory_usage(index = True).sum()
+
+def session_clear():
+    """Drops all the dataframes kept in memory"""
+    session_frames.clear()
+
+####################################   BYTE OFFSETS INDEX   ############################
+# A sparse index with the date and the byte position of one row every offsets_step rows. It is saved as a .npy
+# file next to the cache entries of the same source(see cache_path()) and is invalidated in the same way.
+
+def offsets_path(filename, index_col, separator):
+    """Returns the byte offsets index adress for a source file in its current state, or None if the file does not exist"""
+    path = cache_path(filename, index_col, separator)
+    if path is None:
+        return None
+    return path[:-4] + '.npy'
+
+def offsets_build(filename, index_col, separator, step = None):
+    """Builds and saves the byte offsets index of a file. Newlines are found block by block with numpy, so the
+    file is never fully loaded, and only the dates of the indexed rows and of the last row are parsed. Returns the (2,n) array with
+    dates as int64 nanoseconds and byte positions, or None if the indexed dates are not ascending"""
+    if step is None:
+        step = offsets_step
+    size = os.path.getsize(filename)
+    positions = []
+    with open(filename, 'rb') as source:
+        header = source.readline()
+        names = [name.strip().strip('"') for name in header.decode('utf-8').rstrip('\r\n').split(separator)]
+        position = names.index(index_col)
+        block_start = len(header)
+        rows = 1 # row 0 starts right after the header
+        positions.append(block_start)
+        last_start = block_start
+        while True:
+            block = source.read(offsets_blocksize)
+            if len(block) == 0:
+                break
+            starts = np.flatnonzero(np.frombuffer(block, dtype = np.uint8) == 10) + block_start + 1
+            numbers = np.arange(rows, rows + len(starts))
+            positions.extend(starts[(numbers % step == 0) & (starts < size)].tolist())
+            if len(starts) > 0 and starts[-1] < size:
+                last_start = starts[-1]
+            elif len(starts) > 1:
+                last_start = starts[-2]
+            rows = rows + len(starts)
+            block_start = block_start + len(block)
+        if last_start > positions[-1]:
+            positions.append(int(last_start)) # the last row is always indexed, so that its date is checked too
+        dates = []
+        for start in positions:
+            source.seek(start)
+            dates.append(source.readline().decode('utf-8').split(separator)[position].strip().strip('"'))
+    if len(positions) > 0 and positions[-1] >= size:
+        positions, dates = positions[:-1], dates[:-1]
+    if len(positions) == 0:
+        return None
+    dateformat = detect_dateformat(dates)
+    if dateformat is None:
+        times = pd.DatetimeIndex(pd.to_datetime(dates))
+    else:
+        times = pd.DatetimeIndex(pd.to_datetime(dates, format = dateformat))
+    if times.is_monotonic_increasing == False or times.hasnans:
+        return None
+    table = np.vstack([times.values.astype('datetime64[ns]').astype(np.int64), np.array(positions, dtype = np.int64)])
+    if os.path.isdir(cache_folder) == False:
+        os.makedirs(cache_folder)
+    cache_clear(filename, extension = '.npy')
+    np.save(offsets_path(filename, index_col, separator), table)
+    return table
+
+####################################   MULTIPLE FILES READER   ############################
+
+def getts_many(files, index_col, indexparse, separator, limits, processes = None, **options):
+    """
+    Gets many timeseries files(i.e.: one csv per gauge) in a single Pandas dataframe, with one collumn per series
+    aligned on a common date index, as fetched by getts() from a master sheet. Files are read in parallel by a
+    pool of processes. Module arguments are:
+        1. A folder adress or a glob pattern(i.e.: r'C:\gauges\*.csv') as String, or a list of file adresses. For
+        a folder, all the .csv and .txt files in it are read
+        2-5. The same from getts()
+        6. The number of processes(standard = None, one per processor)
+        7. Any other getts() keyword argument(cache, dateformat, columns, dtype...), used for every file
+    Dates missing from a file are filled with NaN. When the same collumn name shows up in more than one file,
+    the collumns are renamed to '<file name>_<collumn name>'. Dates repeated within a file are reported and only
+    their first row is kept, so that the files can be aligned. The workers do not prune the cache: it is pruned
+    once(see cache_prune()) after all the files are read
+    """
+    if isinstance(files, str):
+        if os.path.isdir(files):
+            files = glob.glob(os.path.join(files, '*.csv')) + glob.glob(os.path.join(files, '*.txt'))
+        else:
+            files = glob.glob(files)
+    files = sorted(files)
+    jobs = [(filename, index_col, indexparse, separator, limits, options) for filename in files]
+    if processes == 1 or len(jobs) < 2:
+        frames = [getts_many_worker(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer = getts_many_init)
+        try:
+            frames = pool.map(getts_many_worker, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+        if options.get('cache', True) == True:
+            cache_prune()
+    names = []
+    for data_df in frames:
+        if data_df is not None:
+            names.extend(list(data_df.columns))
+    loaded = []
+    for k in range(len(files)):
+        if frames[k] is None:
+            print('Warning: %s could not be read and was left out' % (files[k]))
+            continue
+        duplicated = frames[k].index.duplicated()
+        if duplicated.any():
+            print('Warning: %s repeats %d dates(i.e.: %s). Only the first row of each date was kept'
+                  % (files[k], duplicated.sum(), frames[k].index[duplicated][0]))
+            frames[k] = frames[k][duplicated == False]
+        stem = os.path.splitext(os.path.basename(files[k]))[0]
+        rename = {}
+        for name in frames[k].columns:
+            if names.count(name) > 1:
+                rename[name] = '%s_%s' % (stem, name)
+        loaded.append(frames[k].rename(columns = rename))
+    if len(loaded) == 0:
+        return None
+    data_df = pd.concat(loaded, axis = 1, join = 'outer', sort = True)
+    data_df.index.name = index_col
+    return data_df
+
+def getts_many_init():
+    """Turns off the cache pruning of each cache_save() in a getts_many() worker process"""
+    global cache_autoprune
+    cache_autoprune = False
+
+def getts_many_worker(job):
+    """Reads one file for getts_many() in a worker process"""
+    filename, index_col, indexparse, separator, limits, options = job
+    return getts(filename, index_col, indexparse, separator, limits, **options)
+
 ####################################PARSING MODULES ############################
     
 def file_parser():
@@ -98,10 +671,28 @@ Ans[AsRaw]: """))
         
         return header, indexparser
         
-def df_parser (filename, header, indexparser, limits):
-        data_df = getts (filename = filename, index_col = header, indexparse = indexparser, separator = ',', limits= limits)
+def df_parser (filename, header, indexparser, limits, columns = None, dtype = None, chunksize = None, offsets = False):
+        data_df = session_load(filename, header, columns, dtype)
+        if data_df is None and os.path.getsize(filename) <= session_maxsize:
+            data_df = getts (filename = filename, index_col = header, indexparse = indexparser, separator = ',', limits= None,
+                             columns = columns, dtype = dtype)
+            session_save(data_df, filename, header, columns, dtype)
+        if data_df is not None:
+            data_df = data_df.loc['%s'%(limits[0]):'%s'%(limits[1])]
+        else:
+            data_df = getts (filename = filename, index_col = header, indexparse = indexparser, separator = ',', limits= limits,
+                             columns = columns, dtype = dtype, chunksize = chunksize, offsets = offsets)
         timeseries_list = list(data_df)
         return data_df, timeseries_list        
+
+def columns_parser(filename, header):
+        timeseries_list = getts_columns(filename, header, ',')
+        return timeseries_list
+
+def selected_parser(filename, header, indexparser, limits, rainlist, flowlist):
+        dtype = dict((name, rainfall_dtype) for name in rainlist if name not in flowlist)
+        data_df = df_parser(filename, header, indexparser, limits, columns = rainlist + flowlist, dtype = dtype, offsets = True)[0]
+        return data_df
         
 def rf_parser(timeseries_list):
     
@@ -149,7 +740,7 @@ Case negative just respond "N"
 Ans[AsRaw] : """)
     return flowlist, ans_select_output
 ####################################HYDROLOGICAL SERIES PRINTER ############################
-def hsprinter (data_df, flow_list, rainfall_list, output = '', print_tofile = True, dpi = 600, size = (30,10)):
+def hsprinter (data_df, flow_list, rainfall_list, output = '', print_tofile = True, dpi = 600, size = (30,10), decimate = True):
     """Prints a set of time series using matplotlib. Flow values are printed normally. rainfalll values are printed upside-down.
     A legend and title are also printed. It uses as inputs:
         1)A Pandas DataFrame - See the getts() module for help
@@ -157,32 +748,40 @@ def hsprinter (data_df, flow_list, rainfall_list, output = '', print_tofile = Tr
         3)A list with the names of collumns to be fetched and printed as string
         4)A fileadress to save the result of the plot. Currently the pictures are saved in 600 dpi in a 10in x 30 in frame.
         5)An optional dpi value(standard = 600 dpi)
-        6)A tuple containing values of width and height in inches(standard = (30,10))"""
-    datelist = data_df.index.tolist()
+        6)A tuple containing values of width and height in inches(standard = (30,10))
+        7)An optional boolean for decimation(standard = True). Case positive, each series is reduced to the minimum
+        and maximum values within each pixel of the figure width before plotting(see minmax_envelope()), so peaks
+        are kept while long records plot much faster"""
+    buckets = None
+    if decimate == True:
+        buckets = int(size[0] * dpi)
     
     colorflow = ['red', 'blue', 'gray', 'cyan']
     colorrfall = ['purple', 'green', 'yellow', 'orange', 'black', 'navy', 'brown','red']
     
     flow = []
+    flow_dates = []
     for i in flow_list:
-        fltemp = data_df[i].tolist()
-        flow.append(fltemp) 
+        positions = minmax_envelope(data_df[i].values, buckets)
+        flow.append(data_df[i].values[positions]) 
+        flow_dates.append(data_df.index[positions])
         
     rfall = []
+    rfall_dates = []
     for i in rainfall_list:
-        rftemp = data_df[i].tolist()
-        rfall.append(rftemp) 
+        positions = minmax_envelope(data_df[i].values, buckets)
+        rfall.append(data_df[i].values[positions]) 
+        rfall_dates.append(data_df.index[positions])
     
-    fig = plt.figure(figsize = (30,10))
+    fig = plt.figure(figsize = size)
     ax1 = fig.add_subplot(212)
        
     for index in range(len(flow_list)):
-        ax1.plot_date(x = datelist , y = flow[index], linestyle='solid', marker='None', 
+        ax1.plot_date(x = flow_dates[index] , y = flow[index], linestyle='solid', marker='None', 
                       label = flow_list[index], xdate = True, color = colorflow[index] , linewidth=1.0, alpha=0.7)
     ax1.set_ylabel('Vazao (m3/s)')
-    fig_limit = data_df.index.tolist()
-    fig_limits_lower = fig_limit[1]
-    fig_limits_upper = fig_limit[-1]
+    fig_limits_lower = data_df.index[1]
+    fig_limits_upper = data_df.index[-1]
     ax1.set_xlim(fig_limits_lower, fig_limits_upper)
     ax1.grid()
     ax1.legend()
@@ -193,14 +792,13 @@ def hsprinter (data_df, flow_list, rainfall_list, output = '', print_tofile = Tr
     ax2 = fig.add_subplot(211, sharex = ax1)
     
     for index in range(len(rainfall_list)):
-        ax2.plot_date(x = datelist , y = rfall[index], linestyle='solid', marker='None', 
+        ax2.plot_date(x = rfall_dates[index] , y = rfall[index], linestyle='solid', marker='None', 
                       label = rainfall_list[index], xdate = True, color = colorrfall[index], linewidth=1.0, alpha=0.7)
     ax2.legend()
     ax2.set_ylabel('Precipitacao (mm)')
     plt.gca().invert_yaxis()
-    fig_limit = data_df.index.tolist()
-    fig_limits_lower = fig_limit[1]
-    fig_limits_upper = fig_limit[-1]
+    fig_limits_lower = data_df.index[1]
+    fig_limits_upper = data_df.index[-1]
     ax2.set_xlim(fig_limits_lower, fig_limits_upper)
     ax2.grid()
     ax1.legend()
@@ -219,6 +817,30 @@ def hsprinter (data_df, flow_list, rainfall_list, output = '', print_tofile = Tr
     
     plt.show()    
 
+def minmax_envelope(values, buckets):
+    """Returns the positions of the samples to be plotted from a series so that the line looks the same at a given
+    width in pixels. The series is split in buckets of consecutive samples(one per pixel) and the positions of the
+    minimum and maximum of each bucket are kept, in time order, so peaks are never lost. Buckets with no data
+    keep one NaN sample, so gaps still break the line. If buckets is None or the series is short, all positions
+    are returned"""
+    size = len(values)
+    if buckets is None or size <= 2 * buckets:
+        return np.arange(size)
+    per = int(math.ceil(float(size) / buckets))
+    rows = int(math.ceil(float(size) / per))
+    padded = np.full(rows * per, np.nan)
+    padded[:size] = values
+    padded = padded.reshape(rows, per)
+    missing = np.isnan(padded)
+    lowest = np.argmin(np.where(missing, np.inf, padded), axis = 1)
+    highest = np.argmax(np.where(missing, -np.inf, padded), axis = 1)
+    empty = missing.all(axis = 1)
+    lowest[empty] = np.argmax(missing[empty], axis = 1)
+    highest[empty] = lowest[empty]
+    starts = np.arange(rows) * per
+    positions = np.sort(np.vstack([starts + lowest, starts + highest]), axis = 0).T.ravel()
+    return np.unique(np.minimum(positions, size - 1))
+
 #hsrinter test function
 def test_hsprinter():
     """
@@ -243,7 +865,7 @@ def test_hsprinter():
     obtain a stable version of the program or contact the developer"""
     assert success, msg
     
-def hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output):
+def hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output, limits):
      ans_select_print = int(raw_input("""
 Which input would you like to change
 1 - Printing limits
@@ -253,19 +875,21 @@ Which input would you like to change
 Ans[AsRawInteger]: """))
      if ans_select_print == 1 :
         limits = limit_parser(filename)
-        data_df, timeseries_list = df_parser(filename, header, indexparser, limits)
+        data_df = selected_parser(filename, header, indexparser, limits, rainlist, flowlist)
         print_launcher(data_df,flowlist, rainlist, output = ans_select_output)
-        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output)
+        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output, limits)
         
      elif ans_select_print == 2 :
         rainlist = rf_parser(timeseries_list)
+        data_df = selected_parser(filename, header, indexparser, limits, rainlist, flowlist)
         print_launcher(data_df,flowlist, rainlist, output = ans_select_output)
-        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output)
+        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output, limits)
         
      elif ans_select_print == 3 :
-        flowlist = fl_parser(timeseries_list)[0]
+        flowlist = fl_parser(timeseries_list, 1)[0]
+        data_df = selected_parser(filename, header, indexparser, limits, rainlist, flowlist)
         print_launcher(data_df,flowlist, rainlist, output = ans_select_output)
-        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output)
+        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output, limits)
            
 #  hsprinter Launcher   
 def print_launcher(data_df,flowlist, rainlist, output = ans_select_output, print_tofile = True):    
@@ -284,45 +908,26 @@ def missingreport (data_df, flow_list, rainfall_list, output, printfig = True, o
         rainfalll_list: A list containing the headers of rainfalll collumns which the user wants plotted
         printfig : A boolean for printing an output file
         output : A string with the output folder and file
+    Each series is drawn as one bar per period with data(see available_intervals()), so the drawing cost
+    depends on the number of gaps and not on the number of values
     """
-    k = 0
     plt.ion()
-    datelist = data_df.index.tolist()
     colorflow = ['red', 'blue', 'green', 'cyan', 'gold', 'tomato', 'steelblue', 'coral', 'sandybrown', 'goldenrod']
     colorrfall = ['purple', 'orange', 'darkmagenta', 'navy', 'slategray', 'black','mediumblue','fuchsia', 'navy', 'brown']
     
-    flow = []
-    for i in flow_list:
-        k = k+1
-        fltemp = data_df[i].tolist()
-        for j in range(len(fltemp)):
-            if math.isnan(float(fltemp[j])) == False:
-                fltemp[j] = k
-        flow.append(fltemp) 
-            
-    rfall = []
-    
-    for i in rainfall_list:
-        k = k+1
-        rftemp = data_df[i].tolist()
-        for j in range(len(rftemp)):
-            if math.isnan(float(rftemp[j])) == False:
-                rftemp[j] = k
-        rfall.append(rftemp) 
+    series_list = list(flow_list) + list(rainfall_list)
+    colors = colorflow[:len(flow_list)] + colorrfall[:len(rainfall_list)]
+    intervals = available_intervals(data_df, series_list)
         
     fig, ax = plt.subplots(figsize=figsize)
+    ax.xaxis_date()
        
-    for index in range(len(flow)):
-        ax.plot_date(x = datelist , y = flow[index], linestyle='solid', marker='None', 
-                      label = flow_list[index], xdate = True, color = colorflow[index] , linewidth=6)
-  
-    for index in range(len(rfall)):
-        ax.plot_date(x = datelist , y = rfall[index], linestyle='solid', marker='None', 
-                      label = rainfall_list[index], xdate = True, color = colorrfall[index] , linewidth=6)
+    for index in range(len(series_list)):
+        ax.broken_barh(intervals[index], (index + 0.75, 0.5), facecolors = colors[index], label = series_list[index])
+    ax.set_ylim(0.5, len(series_list) + 0.5)
     ax.set_ylabel('Vazao (m3/s)')
-    fig_limit = data_df.index.tolist()
-    fig_limits_lower = fig_limit[0]
-    fig_limits_upper = fig_limit[-1]
+    fig_limits_lower = data_df.index[0]
+    fig_limits_upper = data_df.index[-1]
     ax.get_yaxis().set_visible(False)          
     ax.grid(b=True, which = 'major', linewidth = 0.7)
     ax.grid(b=True, which = 'minor', linewidth = 0.1, color = 'black')
@@ -345,6 +950,151 @@ def missingreport (data_df, flow_list, rainfall_list, output, printfig = True, o
     
     plt.show()
             
+def available_intervals(data_df, columns):
+    """Returns, for each listed collumn, a list of (start, width) tuples in matplotlib date units with the periods
+    of consecutive available values, as used by broken_barh(). A period goes from its first to its last date"""
+    column, start, stop = mask_runs(gapmask(data_df, columns) == False)
+    starts = matplotlib.dates.date2num(data_df.index[start].to_pydatetime())
+    ends = matplotlib.dates.date2num(data_df.index[stop - 1].to_pydatetime())
+    intervals = [[] for name in columns]
+    for k in range(len(column)):
+        intervals[column[k]].append((starts[k], ends[k] - starts[k]))
+    return intervals
+
+def gapmask(data_df, columns):
+    """Returns a (rows x collumns) boolean array, True where the values of the listed collumns are missing"""
+    return pd.isnull(data_df[list(columns)]).values
+
+def mask_runs(mask, breaks = None):
+    """Run-length encodes a (rows x collumns) boolean array. Returns three integer arrays: the collumn, the first
+    row and the row after the last one of every run of True values, ordered by collumn and then by row.
+    breaks is an optional boolean array with one value per row, True where a run must be split(the row starts
+    a new run), i.e.: the first row of each year"""
+    mask = np.asarray(mask, dtype = bool)
+    previous = np.zeros(mask.shape, dtype = bool)
+    previous[1:] = mask[:-1]
+    following = np.zeros(mask.shape, dtype = bool)
+    following[:-1] = mask[1:]
+    if breaks is not None:
+        breaks = np.asarray(breaks, dtype = bool)
+        previous[breaks] = False
+        following[:-1][breaks[1:]] = False
+    column, start = np.nonzero((mask & (previous == False)).T)
+    stop = np.nonzero((mask & (following == False)).T)[1] + 1
+    return column, start, stop
+
+def gapreport(data_df, columns = None):
+    """Finds the gaps(periods of consecutive missing values) of all the listed collumns at once. Returns a dataframe
+    with one row per gap and the collumns:
+        station: the collumn name
+        start: the date of the first missing value
+        end: the date of the last missing value
+        length: the number of missing values
+    If columns is None(standard), all the dataframe collumns are used"""
+    if columns is None:
+        columns = list(data_df.columns)
+    column, start, stop = mask_runs(gapmask(data_df, columns))
+    gaps_df = pd.DataFrame({'station': np.array(columns, dtype = object)[column],
+                            'start': data_df.index[start], 'end': data_df.index[stop - 1], 'length': stop - start},
+                           columns = ['station', 'start', 'end', 'length'])
+    return gaps_df
+
+def gapreport_file(filename, index_col, separator, columns = None, chunksize = 100000, dateformat = None):
+    """Finds the gaps of a file in the same way as gapreport(), reading it in chunks of chunksize rows so that the
+    memory use depends on the chunk size and on the number of gaps, and never on the file length. Gaps still open
+    at the end of a chunk are carried to the next one. The file rows must be in date order. If columns is
+    None(standard), all the file collumns are used. If dateformat is None, it is detected from the first chunk"""
+    if columns is None:
+        columns = getts_columns(filename, index_col, separator)
+    columns = list(columns)
+    names = np.array(columns, dtype = object)
+    open_start = np.zeros(len(columns), dtype = np.int64)
+    open_end = np.zeros(len(columns), dtype = np.int64)
+    open_length = np.zeros(len(columns), dtype = np.int64)
+    found = []
+    reader = pd.read_csv(filename, index_col = index_col, sep = separator, dtype = {index_col: str},
+                         usecols = [index_col] + sorted(set(columns), key = columns.index), chunksize = chunksize)
+    detected = dateformat is not None
+    for chunk in reader:
+        if len(chunk) == 0:
+            continue
+        if detected == False:
+            dateformat = detect_dateformat(chunk.index)
+            detected = True
+        if dateformat is None:
+            dates = pd.DatetimeIndex(pd.to_datetime(chunk.index))
+        else:
+            dates = pd.DatetimeIndex(pd.to_datetime(chunk.index, format = dateformat))
+        dates = dates.values.astype('datetime64[ns]').astype(np.int64)
+        column, start, stop = mask_runs(gapmask(chunk, columns))
+        run_start = dates[start]
+        run_end = dates[stop - 1]
+        run_length = stop - start
+        continuing = (start == 0) & (open_length[column] > 0)
+        run_start[continuing] = open_start[column[continuing]]
+        run_length[continuing] = run_length[continuing] + open_length[column[continuing]]
+        closing = open_length > 0
+        closing[column[continuing]] = False
+        closed = np.flatnonzero(closing)
+        found.append((closed, open_start[closed], open_end[closed], open_length[closed]))
+        ending = stop == len(chunk)
+        done = ending == False
+        found.append((column[done], run_start[done], run_end[done], run_length[done]))
+        open_length[:] = 0
+        open_start[column[ending]] = run_start[ending]
+        open_end[column[ending]] = run_end[ending]
+        open_length[column[ending]] = run_length[ending]
+    reader.close()
+    closed = np.flatnonzero(open_length > 0)
+    found.append((closed, open_start[closed], open_end[closed], open_length[closed]))
+    column = np.concatenate([part[0] for part in found]).astype(int)
+    gaps_df = pd.DataFrame({'column': column,
+                            'start': np.concatenate([part[1] for part in found]).astype('datetime64[ns]'),
+                            'end': np.concatenate([part[2] for part in found]).astype('datetime64[ns]'),
+                            'length': np.concatenate([part[3] for part in found]).astype(np.int64)})
+    gaps_df = gaps_df.sort_values(['column', 'start']).reset_index(drop = True)
+    gaps_df['station'] = names[gaps_df['column'].values]
+    return gaps_df[['station', 'start', 'end', 'length']]
+
+def completenessreport(data_df, columns = None, gap_threshold = 24, output = None):
+    """Computes data completeness statistics for each collumn by year, month, season(see period_codes()) and for
+    the whole dataframe. December is counted in the season of the following year. Returns a dataframe with the
+    collumns:
+        station: the collumn name
+        period: 'year', 'month', 'season' or 'all'
+        group: the period label, i.e.: '2005', '2005-03', '2005-DJF' or 'all'
+        availability: the percentage of values available
+        longest_gap: the longest run of missing values within the period, in number of values
+        long_gaps: the number of runs of missing values within the period with at least gap_threshold values
+    Gaps are split at the period boundaries, so a period with no values at all has one gap as long as the period.
+    Case an output adress is given, the table is also saved to a csv file. No figure is printed"""
+    if columns is None:
+        columns = list(data_df.columns)
+    missing = gapmask(data_df, columns)
+    period_groups = period_codes(data_df.index)
+    tables = []
+    for period in ['year', 'month', 'season', 'all']:
+        codes = period_groups[period]
+        available = pd.DataFrame(missing == False).groupby(codes).mean() * 100.
+        table = available.stack().reset_index()
+        table.columns = ['code', 'column', 'availability']
+        column, start, stop = mask_runs(missing, np.r_[False, codes[1:] != codes[:-1]])
+        gaps = pd.DataFrame({'code': codes[start], 'column': column, 'length': stop - start,
+                             'long': (stop - start) >= gap_threshold})
+        gaps = gaps.groupby(['code', 'column']).agg({'length': 'max', 'long': 'sum'}).reset_index()
+        table = table.merge(gaps, on = ['code', 'column'], how = 'left').fillna({'length': 0, 'long': 0})
+        table['station'] = np.array(columns, dtype = object)[table['column'].values]
+        table['period'] = period
+        table['group'] = period_labels(period, table['code'].values)
+        table['longest_gap'] = table['length'].astype(int)
+        table['long_gaps'] = table['long'].astype(int)
+        tables.append(table.sort_values(['column', 'code']))
+    report_df = pd.concat(tables)[['station', 'period', 'group', 'availability', 'longest_gap', 'long_gaps']]
+    report_df = report_df.reset_index(drop = True)
+    if output is not None:
+        report_df.to_csv(output, index = False)
+    return report_df
+
 #missingreport TEST        
 def test_missingreport():
     """Tests the missing report function with a known set of values. The main goal is to see if a 
@@ -368,6 +1118,29 @@ def test_missingreport():
     obtain a stable version of the program or contact the developer"""
     assert success, msg
     
+def test_gapreport_file():
+    """Tests the chunked gap scanner against gapreport() on the whole test file. The gaps must be the same for
+    any chunk size, from one row per chunk(every gap crosses chunks) to the whole file in one chunk, and with the
+    date format detected from the first chunk"""
+    cwd = os.getcwd()
+    test_folder = os.path.join(cwd,r'test')
+    fileinput = os.path.join(test_folder,'Planilha_mestra.csv')
+    data_df = getts(fileinput, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = None,
+                    cache = False)
+    expected = gapreport(data_df)
+    msg = """Your gap scanner is not working properly. Please contact the Administrator or obtain a stable version"""
+    for chunksize in [1, 2, 7, 1000, 6575, 100000]:
+        calculated = gapreport_file(fileinput, 'Datahora', ',', chunksize = chunksize, dateformat = '%m/%d/%Y %H:%M')
+        assert list(calculated['station']) == list(expected['station']), msg
+        assert (calculated['start'].values == expected['start'].values).all(), msg
+        assert (calculated['end'].values == expected['end'].values).all(), msg
+        assert (calculated['length'].values == expected['length'].values).all(), msg
+    calculated = gapreport_file(fileinput, 'Datahora', ',', columns = ['Simepar', 'Tmd_vaz'], chunksize = 50)
+    expected = gapreport(data_df, ['Simepar', 'Tmd_vaz'])
+    assert list(calculated['station']) == list(expected['station']), msg
+    assert (calculated['start'].values == expected['start'].values).all(), msg
+    assert (calculated['length'].values == expected['length'].values).all(), msg
+
 #missingreport DURATION PARSER    
 def event_duration_parser():
     ans_duration = raw_input("""
@@ -402,7 +1175,8 @@ def sep_straight(data_df, event_datelist, flow_name, output):
     Suggestion: Use hsprinter() from this module.
     
     The volume is obtained through the straight line method. It connects the endpoint with the
-    starting point. Total volume is calculated by integration. FLOW Values must be in cms. The
+    starting point. Total volume is calculated by trapezoidal integration over the dates, so any
+    timestep works, and is given in volume_unit. FLOW Values must be in cms. The
     function requires:
         1. A Pandas DataFrame - Using getts is suggested as String
         2. List of dates - A list with dates in the Python datetime.datetime format. Only two values 
@@ -429,23 +1203,15 @@ def sep_straight(data_df, event_datelist, flow_name, output):
         sys.exit(1)
 #BASIC COMPUTATIONS FOR THE STRAIGHT LINE METHOD#
     data_df_limited = data_df.loc['%s'%(event_datelist[0]):'%s'%(event_datelist[1])]
-    flow_start_row = data_df_limited.iloc[0]
-    flow_start = flow_start_row['%s' % (FLOWFieldName)]
-    flow_end_row = data_df_limited.iloc[-1]
-    flow_end = flow_end_row['%s' % (FLOWFieldName)]
-    delta_t = event_datelist[1]-event_datelist[0]
-    delta_t = delta_t.total_seconds()
+    flow_obs_lim = data_df_limited['%s' % (FLOWFieldName)].dropna()
+    flow_start = flow_obs_lim.iloc[0]
+    flow_end = flow_obs_lim.iloc[-1]
+    delta_t = (flow_obs_lim.index[-1] - flow_obs_lim.index[0]).total_seconds()
     
-##STRAIGHT LINE METHOD#
-    flow_obs_lim = data_df_limited['%s' % (FLOWFieldName)].tolist()
-    m = (flow_end-flow_start)/(len(flow_obs_lim))
-    x = np.arange(0,len(flow_obs_lim))
-    y0 = np.zeros(len(flow_obs_lim)) + flow_start
-    x = np.arange(0,len(flow_obs_lim))
-    vaz_sub = y0 + m*x
-    difference = flow_obs_lim-vaz_sub
-    sumdif = np.sum(difference)
-    vol = sumdif * len(flow_obs_lim)
+##STRAIGHT LINE METHOD - TRAPEZOIDAL INTEGRATION OVER THE DATES(see sep_events())#
+    elapsed = (data_df_limited.index - flow_obs_lim.index[0]).total_seconds()
+    vaz_sub = flow_start + (flow_end - flow_start) * np.asarray(elapsed) / delta_t
+    vol = sep_events(data_df_limited, [(flow_obs_lim.index[0], flow_obs_lim.index[-1])], [FLOWFieldName])['runoff_volume'].iloc[0]
     
 #PLOTTING#
     datelist = data_df.index.tolist()
@@ -467,7 +1233,7 @@ def sep_straight(data_df, event_datelist, flow_name, output):
     ax.grid()
     ax.legend()
     bbox_props = dict(boxstyle="round", fc="w", ec="0.5", alpha=0.9)
-    ax.annotate('The total runoff volume is %.3f \n cms for this event' % (vol)
+    ax.annotate('The total runoff volume is %.3f \n %s for this event' % (vol, volume_unit)
                 , xy= (0.8,0.75), xytext=(0.8, 0.75), xycoords='figure fraction', bbox=bbox_props)
     plt.title('Separated Runuff - Straight Line method', fontsize=20)
     fig.autofmt_xdate()
@@ -477,29 +1243,453 @@ def sep_straight(data_df, event_datelist, flow_name, output):
         a = 2 #dummy
     plt.show()
     
-    print "This event had a total runoff of %.3d cms" % (vol)
+    print "This event had a total runoff of %.3f %s" % (vol, volume_unit)
+    return vol
 #sep_straight TEST
 def test_sep_straight():
     """Tests the function of runoff separation in an event. The functions tests the results
-    of an event between 1/9/2016 18:00 to 1/23/2016 at 23:00. Case the function return an expected value,
+    of an event between 7/29/2011 and 8/11/2011 at the 65019700_cax gauge. Case the function return an expected value,
     no value is printed. Also, the graphic is plotted for evaluation and matplotlib library functionality"""
     
-    limits = [datetime.datetime(2016, 1, 9, 18),datetime.datetime(2016, 1, 23, 23)]
+    limits = [datetime.date(2011, 7, 1),datetime.date(2011, 8, 31)]
 
-    event_duration = [datetime.datetime(2016, 1, 9, 19),datetime.datetime(2016, 1, 18, 20, 01),]
+    event_duration = [datetime.datetime(2011, 7, 29),datetime.datetime(2011, 8, 11),]
     cwd = os.getcwd()
     test_folder = os.path.join(cwd,r'test')
-    fileinput_str = os.path.join(test_folder,'tamandare_2016.csv')
+    fileinput_str = os.path.join(test_folder,'Planilha_mestra.csv')
     saida = os.path.join(test_folder,'sep_fig.png')
     data_df = getts(fileinput_str, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = limits)
-    calculated = sep_straight(data_df,event_duration, FLOWFieldName = 'Vazao', output = saida)
-    expected = 24909909
-    success = calculated - expected < 5
+    calculated = sep_straight(data_df,event_duration, flow_name = '65019700_cax', output = saida)
+    expected = 28613088. # m3
+    success = abs(calculated - expected) < 5
     
     msg = """calculated %s, expected %s. Values for total runoff are not
     the same. Please contact the Administrator or obtain a stable version""" % (calculated, expected)
     assert success, msg
 
+def test_sep_events():
+    """Tests the multiple events separation against a brute force trapezoidal sum, event by event, on two collumns
+    with an irregular timestep and missing flows. Events partly or fully outside the series, with less than two
+    flows available or with the end before the start are included"""
+    random = np.random.RandomState(0)
+    steps = random.randint(10, 180, size = 2000) * 60 # irregular timesteps, from 10 minutes to 3 hours
+    dates = pd.Timestamp('2011-01-01') + pd.to_timedelta(np.cumsum(steps), unit = 's')
+    flows = random.lognormal(size = (2000, 2))
+    flows[random.rand(2000, 2) < 0.15] = np.nan
+    flows[700:760, 0] = np.nan # a long gap
+    data_df = pd.DataFrame(flows, index = dates, columns = ['a', 'b'])
+    positions = np.sort(random.randint(-50, 2050, size = (40, 2)), axis = 1)
+    events = [(dates[0] + pd.Timedelta(minutes = 100 * int(first)), dates[0] + pd.Timedelta(minutes = 100 * int(last)))
+              for first, last in positions] + [(dates[710], dates[740]), (dates[30], dates[20])]
+    results_df = sep_events(data_df, events)
+    msg = """The multiple events separation is not working properly. Please contact the Administrator or obtain a
+    stable version"""
+    assert len(results_df) == 2 * len(events), msg
+    for k in range(len(results_df)):
+        row = results_df.iloc[k]
+        inside = data_df[(data_df.index >= row['start']) & (data_df.index <= row['end'])][row['station']]
+        assert row['samples'] == len(inside) and row['missing'] == inside.isnull().sum(), msg
+        available = inside.dropna()
+        if len(available) < 2:
+            assert np.isnan(row['runoff_volume']) and np.isnan(row['base_volume']), msg
+            continue
+        q = available.values
+        t = (available.index - available.index[0]).total_seconds().values
+        total = 0.
+        for i in range(len(q) - 1):
+            total = total + (q[i] + q[i + 1]) / 2. * (t[i + 1] - t[i])
+        base = (q[0] + q[-1]) / 2. * t[-1]
+        assert np.isclose(row['base_volume'], base) and np.isclose(row['runoff_volume'], total - base), msg
+        assert row['peak'] == q.max(), msg
+
+def test_detect_events():
+    """Tests the event detection on a synthetic daily hydrograph with a baseflow of 1 and known events: a single
+    peak, a second rise before the recession(one event), a rise below min_rise and a rise cut by the end of the
+    series, which is only kept without a minimum prominence. The catalog must also be taken by sep_events()"""
+    q = np.ones(400)
+    q[50:61] = 1. + np.arange(11) # peak of 11 at 60
+    q[61:91] = 1. + 10. * 0.5 ** np.arange(1, 31)
+    q[150:161] = 1. + np.arange(11) # peak of 11 at 160, receding to 6 at 161
+    q[161:167] = 6. + 2. * np.arange(6) # peak of 16 at 166
+    q[167:197] = 1. + 15. * 0.5 ** np.arange(1, 31)
+    q[251:253] = [2., 3.] # a rise of 2
+    q[390:400] = 1. + np.arange(10)
+    data_df = pd.DataFrame({'q': q}, index = pd.date_range('2000-01-01', periods = 400, freq = 'D'))
+    dates = data_df.index
+    msg = """The event detection is not working properly. Please contact the Administrator or obtain a stable version"""
+    events_df = detect_events(data_df, 'q', min_rise = 5., recession = 0.9)
+    assert list(events_df['start']) == [dates[50], dates[150], dates[390]], msg
+    assert list(events_df['peak_date']) == [dates[60], dates[166], dates[399]], msg
+    assert list(events_df['end']) == [dates[64], dates[170], dates[399]], msg
+    events_df = detect_events(data_df, ['q'], min_rise = 5., min_prominence = 1.)
+    assert list(events_df['peak_date']) == [dates[60], dates[166]], msg
+    results_df = sep_events(data_df, events_df)
+    assert len(results_df) == 2 and (results_df['runoff_volume'] > 0).all(), msg
+
+######################################RUNOFF SEP - MULTIPLE EVENTS##########################
+def sep_events(data_df, events, flow_names = None):
+    """
+    Separates runoff with the straight line method for many events at once, without plotting. The baseflow of an
+    event is the straight line between the flows at its first and last dates. It uses:
+        1. A Pandas DataFrame with sorted dates - Using getts is suggested
+        2. The events, as a list of (start, end) dates or as a dataframe with 'start' and 'end' collumns. If the
+        dataframe also has a 'station' collumn, each event is computed only for that flow collumn
+        3. A list with the flow collumn names(standard = None, all the collumns). Not used for events with 'station'
+    Returns a dataframe with one row per event and flow collumn and the collumns station, start, end, samples,
+    missing(number of missing flows in the event), peak(maximum flow), base_volume, runoff_volume and unit.
+    Volumes are integrated with the trapezoidal rule over the actual dates, so series with any or irregular
+    timesteps give comparable results, in flow unit times seconds(volume_unit, m3 for flows in cms). Missing
+    flows are bridged by a straight line between the values around them, and the baseflow line goes from the
+    first to the last available flow of the event. Events with less than two available values get NaN. Without
+    events, an empty dataframe with the same collumns is returned.
+    Integrals and maxima come from cumulative arrays computed once per flow collumn, so the cost of an event
+    does not depend on its length. See sep_events_plot() for the figures
+    """
+    if isinstance(events, pd.DataFrame):
+        events_df = events.copy()
+    else:
+        events_df = pd.DataFrame(list(events), columns = ['start', 'end'])
+    if 'station' not in events_df.columns:
+        if flow_names is None:
+            flow_names = list(data_df.columns)
+        events_df = pd.concat([events_df.iloc[:0].assign(station = '')] + [events_df.assign(station = name) for name in flow_names],
+                              ignore_index = True)
+    seconds = data_df.index.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+    tables = []
+    for name, station_df in events_df.groupby('station', sort = False):
+        values = data_df[name].values.astype(np.float64)
+        available = np.flatnonzero(np.isnan(values) == False)
+        flows = values[available]
+        times = seconds[available]
+        areas = np.concatenate([[0.], np.cumsum((flows[1:] + flows[:-1]) / 2. * np.diff(times))])
+        first = data_df.index.searchsorted(pd.DatetimeIndex(station_df['start']), side = 'left')
+        last = data_df.index.searchsorted(pd.DatetimeIndex(station_df['end']), side = 'right') - 1
+        first_available = np.searchsorted(available, first, side = 'left')
+        last_available = np.searchsorted(available, last, side = 'right') - 1
+        valid = last_available > first_available
+        counts = np.maximum(last_available - first_available + 1, 0)
+        first_available = np.where(valid, first_available, 0)
+        last_available = np.where(valid, last_available, min(1, len(available) - 1))
+        samples = np.where(last >= first, last - first + 1, 0)
+        table = station_df.copy()
+        table['samples'] = samples
+        table['missing'] = samples - counts
+        if len(available) < 2:
+            table['peak'], table['base_volume'], table['runoff_volume'] = np.nan, np.nan, np.nan
+            tables.append(table)
+            continue
+        peaks = np.fmax.reduceat(np.append(flows, np.nan), np.vstack([first_available, last_available + 1]).T.ravel())[::2]
+        duration = times[last_available] - times[first_available]
+        base = (flows[first_available] + flows[last_available]) / 2. * duration
+        table['peak'] = np.where(valid, peaks, np.nan)
+        table['base_volume'] = np.where(valid, base, np.nan)
+        table['runoff_volume'] = np.where(valid, areas[last_available] - areas[first_available] - base, np.nan)
+        tables.append(table)
+    if len(tables) == 0:
+        tables.append(events_df.assign(samples = 0, missing = 0, peak = np.nan, base_volume = np.nan, runoff_volume = np.nan))
+    results_df = pd.concat(tables).sort_index()
+    results_df['unit'] = volume_unit
+    columns = ['station', 'start', 'end', 'samples', 'missing', 'peak', 'base_volume', 'runoff_volume', 'unit']
+    return results_df[columns + [name for name in results_df.columns if name not in columns]].reset_index(drop = True)
+
+def detect_events(data_df, flow_names, min_rise = None, min_prominence = 0., recession = 0.9, window = 1):
+    """
+    Finds runoff events in flow collumns and returns an event catalog that sep_events() takes directly. It uses:
+        1. A Pandas DataFrame with sorted dates - Using getts is suggested
+        2. A flow collumn name or a list of names
+        3. The minimum flow rise from the start of an event to its peak(standard = None, the standard deviation of
+        the flows of the collumn)
+        4. The minimum peak prominence: the peak flow minus the highest of the start and end flows(standard = 0)
+        5. The recession criteria, as the fraction of the rise that must be receded for the event to end(standard = 0.9).
+        An event ends at the first flow after the peak below start flow + (1 - recession) x rise, or at the start of
+        the next rise if it comes first. A new rise is part of the same event when the flows never go below that
+        value between the peak and the start of the rise
+        6. The number of values of a centered moving average applied before the detection, to keep noise from
+        breaking rising limbs(standard = 1, no smoothing)
+    The rising limbs are found at once with np.diff over the whole series and filtered by rise before the
+    recessions are searched, so only the candidate events are looped over. Returns a dataframe with the collumns
+    station, start, peak_date and end
+    """
+    if isinstance(flow_names, str):
+        flow_names = [flow_names]
+    tables = []
+    for name in flow_names:
+        flows = data_df[name].astype(np.float64)
+        if window > 1:
+            flows = flows.rolling(window, center = True, min_periods = 1).mean()
+        q = flows.values
+        column, trough, peak = mask_runs((np.diff(q) > 0).reshape(-1, 1))
+        threshold = min_rise
+        if threshold is None:
+            threshold = np.nanstd(q)
+        keep = (q[peak] - q[trough]) >= threshold
+        trough, peak = trough[keep], peak[keep]
+        starts, peaks, ends = [], [], []
+        k = 0
+        while k < len(peak):
+            start, top = trough[k], peak[k]
+            target = q[start] + (1. - recession) * (q[top] - q[start])
+            j = k + 1
+            while j < len(peak) and np.nanmin(q[top:trough[j] + 1]) > target:
+                if q[peak[j]] > q[top]:
+                    top = peak[j]
+                    target = q[start] + (1. - recession) * (q[top] - q[start])
+                j = j + 1
+            limit = len(q) - 1
+            if j < len(peak):
+                limit = trough[j]
+            below = np.flatnonzero(q[top:limit + 1] <= target)
+            end = limit
+            if len(below) > 0:
+                end = top + below[0]
+            starts.append(start)
+            peaks.append(top)
+            ends.append(end)
+            k = j
+        starts, peaks, ends = np.array(starts, dtype = int), np.array(peaks, dtype = int), np.array(ends, dtype = int)
+        prominent = (q[peaks] - np.maximum(q[starts], q[ends])) >= min_prominence
+        starts, peaks, ends = starts[prominent], peaks[prominent], ends[prominent]
+        tables.append(pd.DataFrame({'station': name, 'start': data_df.index[starts], 'peak_date': data_df.index[peaks],
+                                    'end': data_df.index[ends]}, columns = ['station', 'start', 'peak_date', 'end']))
+    return pd.concat(tables, ignore_index = True)
+
+def sep_parallel(data_df, events = None, flow_names = None, processes = None, **detect_options):
+    """
+    Runs sep_events() for many flow collumns in a pool of processes, one collumn per job, and returns all the
+    results in one table. It uses:
+        1. A Pandas DataFrame - Using getts is suggested
+        2. The events, as in sep_events(). If None(standard), the events of each collumn are found by
+        detect_events() inside the workers, with detect_options
+        3. A list with the flow collumn names(standard = None, all the collumns)
+        4. The number of processes(standard = None, one per processor)
+        5. Any detect_events() keyword argument(min_rise, min_prominence, recession, window)
+    The flows are copied once to shared memory(see batch_share()), so workers read the same block instead of
+    getting a copy of the dataframe with each job. Collumns without events(i.e.: flat or empty series) add no rows
+    """
+    if flow_names is None:
+        flow_names = list(data_df.columns)
+    flow_names = sorted(set(flow_names), key = list(flow_names).index)
+    jobs = []
+    for name in flow_names:
+        station_events = None
+        if isinstance(events, pd.DataFrame) and 'station' in events.columns:
+            station_events = events[events['station'] == name].drop('station', axis = 1)
+        elif events is not None:
+            station_events = events
+        jobs.append((name, station_events, detect_options))
+    flows_df = data_df[flow_names]
+    if processes == 1:
+        results = [sep_parallel_worker(job, flows_df) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer = batch_worker_init, initargs = batch_share(flows_df))
+        try:
+            results = pool.map(sep_parallel_worker, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    if len(results) == 0:
+        return sep_events(data_df, [], [])
+    return pd.concat(results, ignore_index = True)
+
+def sep_parallel_worker(job, data_df = None):
+    """Separates the events of one collumn for sep_parallel(), on data_df(standard = batch_shared_df)"""
+    if data_df is None:
+        data_df = batch_shared_df
+    name, events, detect_options = job
+    if events is None:
+        events = detect_events(data_df, name, **detect_options).drop('station', axis = 1)
+    return sep_events(data_df, events, [name])
+
+def sep_events_plot(data_df, results_df, flow_name, output = "N", figsize = (30,10)):
+    """Plots a flow collumn and the straight baseflow lines of its events from a sep_events() result. Case output
+    is not "N", the figure is saved to that adress"""
+    events_df = results_df[results_df['station'] == flow_name]
+    fig = plt.figure(figsize = figsize)
+    ax = plt.gca()
+    ax.plot(data_df.index, data_df[flow_name].values, linestyle='solid', label = 'Observed Flow', color = 'blue', linewidth=1)
+    for k in range(len(events_df)):
+        event_df = data_df[flow_name].loc[events_df['start'].iloc[k]:events_df['end'].iloc[k]]
+        if len(event_df) < 2:
+            continue
+        label = None
+        if k == 0:
+            label = 'Separated Flow'
+        ax.plot([event_df.index[0], event_df.index[-1]], [event_df.iloc[0], event_df.iloc[-1]], linestyle='solid',
+                label = label, color = 'red', linewidth=1)
+    ax.set_ylabel('Flow (cms)', fontsize=16)
+    ax.set_xlabel('Date', fontsize=16)
+    ax.grid()
+    ax.legend()
+    plt.title('Separated Runuff - Straight Line method - %d events' % (len(events_df)), fontsize=20)
+    fig.autofmt_xdate()
+    if output != "N":
+        plt.savefig(output)
+    return fig
+
+######################################RUNOFF SEP - RECURSIVE DIGITAL FILTERS##########################
+# Continuous baseflow separation over whole series, for any number of flow collumns at once. The baseflow is kept
+# within [0, flow] at every step and the constrained value feeds the next step, as in the published filters, so the
+# recursions can't be run by a linear filter. Each step is a clipped affine function of the previous value, and
+# clipped affine functions stay so when composed, which lets clipped_recursion() solve them in blocks with numpy
+# instead of one python step per date. Gaps are filled by linear interpolation before filtering and given back as
+# NaN. Flows are taken as non negative.
+
+def filter_flows(data_df, flow_names):
+    """Returns the flows of the listed collumns as a float64 array with the gaps interpolated, and the gap mask"""
+    if flow_names is None:
+        flow_names = list(data_df.columns)
+    flows_df = data_df[list(flow_names)].astype(np.float64)
+    missing = pd.isnull(flows_df).values
+    filled = flows_df.interpolate(limit_direction = 'both').values
+    return filled, missing
+
+def clipped_recursion(alpha, offsets, lower, upper, initial):
+    """
+    Solves y[0] = initial and y[i] = min(max(alpha * y[i - 1] + offsets[i], lower[i]), upper[i]) for (dates x
+    collumns) arrays, with lower <= upper. The dates are cut in blocks of about sqrt(dates) values: the function of
+    each block is composed for all the blocks at once, the value entering each block is carried from block to block,
+    and the values within the blocks are computed for all the blocks at once. So the python loops take about
+    3 x sqrt(dates) steps, each one over whole arrays
+    """
+    values = np.empty(np.shape(offsets))
+    dates = len(values) - 1 # the dates after the first
+    if dates < 0:
+        return values
+    values[0] = initial
+    if dates == 0:
+        return values
+    size = max(int(np.sqrt(dates)), 1)
+    blocks = -(-dates // size)
+    def split(a):
+        """Returns the dates after the first as a (block x position in block x collumns) array, repeating the last"""
+        padded = np.empty((blocks * size,) + values.shape[1:])
+        padded[:dates] = a[1:]
+        padded[dates:] = a[-1]
+        return padded.reshape((blocks, size) + values.shape[1:])
+    offsets, lower, upper = split(offsets), split(lower), split(upper)
+    wide = np.finfo(np.float64).max / 4. # stands for no limit, staying finite
+    shift = np.zeros((blocks,) + values.shape[1:])
+    low, high = np.full(shift.shape, -wide), np.full(shift.shape, wide)
+    for k in range(size):
+        for limit in (low, high, shift):
+            limit *= alpha
+            limit += offsets[:, k]
+        for limit in (low, high):
+            np.maximum(limit, lower[:, k], out = limit)
+            np.minimum(limit, upper[:, k], out = limit)
+    scale = alpha ** size
+    entering = np.empty(shift.shape)
+    value = values[0]
+    for b in range(blocks):
+        entering[b] = value
+        value = np.minimum(np.maximum(scale * value + shift[b], low[b]), high[b])
+    value = entering
+    for k in range(size):
+        value *= alpha
+        value += offsets[:, k]
+        np.maximum(value, lower[:, k], out = value)
+        np.minimum(value, upper[:, k], out = value)
+        offsets[:, k] = value # the offsets are a copy, overwritten by the values
+    values[1:] = offsets.reshape((blocks * size,) + values.shape[1:])[:dates]
+    return values
+
+def lynehollick_pass(flows, alpha):
+    """Runs one forward pass of the Lyne-Hollick filter over a (dates x collumns) array and returns the baseflow.
+    The quickflow starts at 0 and is kept within [0, flow] at every step"""
+    rises = np.zeros(flows.shape)
+    rises[1:] = (1. + alpha) / 2. * (flows[1:] - flows[:-1])
+    bound = np.maximum(flows, 0.)
+    quickflow = clipped_recursion(alpha, rises, np.zeros(flows.shape), bound, 0.)
+    return flows - quickflow
+
+def sep_lynehollick(data_df, flow_names = None, alpha = 0.925, passes = 3):
+    """
+    Separates baseflow with the Lyne-Hollick filter. Returns a dataframe with the baseflow of each collumn. It uses:
+        1. A Pandas DataFrame - Using getts is suggested
+        2. A list with the flow collumn names(standard = None, all the collumns)
+        3. The filter parameter alpha(standard = 0.925)
+        4. The number of passes(standard = 3). Passes alternate forward and backward, each one filtering the
+        baseflow of the previous one
+    """
+    filled, missing = filter_flows(data_df, flow_names)
+    baseflow = filled
+    for k in range(passes):
+        if k % 2 == 1:
+            baseflow = lynehollick_pass(baseflow[::-1], alpha)[::-1]
+        else:
+            baseflow = lynehollick_pass(baseflow, alpha)
+    baseflow = np.where(missing, np.nan, baseflow)
+    return pd.DataFrame(baseflow, index = data_df.index, columns = list(flow_names or data_df.columns))
+
+def sep_eckhardt(data_df, flow_names = None, alpha = 0.98, bfimax = 0.8):
+    """
+    Separates baseflow with the Eckhardt two parameter filter. Returns a dataframe with the baseflow of each
+    collumn. It uses:
+        1. A Pandas DataFrame - Using getts is suggested
+        2. A list with the flow collumn names(standard = None, all the collumns)
+        3. The recession constant alpha(standard = 0.98, for daily series)
+        4. The maximum baseflow index bfimax(standard = 0.8, perennial streams with porous aquifers)
+    The filter starts at bfimax times the first flow
+    """
+    filled, missing = filter_flows(data_df, flow_names)
+    memory = (1. - bfimax) * alpha / (1. - alpha * bfimax)
+    gain = (1. - alpha) * bfimax / (1. - alpha * bfimax)
+    bound = np.maximum(filled, 0.)
+    baseflow = clipped_recursion(memory, gain * filled, np.zeros(filled.shape), bound, bfimax * bound[0])
+    baseflow = np.where(missing, np.nan, baseflow)
+    return pd.DataFrame(baseflow, index = data_df.index, columns = list(flow_names or data_df.columns))
+
+def bfi(data_df, baseflow_df):
+    """Returns the baseflow index(total baseflow over total flow) of each collumn of a sep_lynehollick() or
+    sep_eckhardt() result, using only the dates with flow"""
+    flows_df = data_df[list(baseflow_df.columns)].astype(np.float64)
+    return baseflow_df.sum() / flows_df.where(baseflow_df.notnull()).sum()
+
+#sep_lynehollick and sep_eckhardt TEST
+def test_baseflow_filters():
+    """Tests the recursive digital filters against plain loops over the values of one collumn, written from the
+    published equations, with the constraint applied at each step. Each filter must give the baseflow of its loop.
+    clipped_recursion() is also checked against a plain loop on random collumns of several lengths"""
+    cwd = os.getcwd()
+    test_folder = os.path.join(cwd,r'test')
+    fileinput = os.path.join(test_folder,'Planilha_mestra.csv')
+    limits = [datetime.date(2005, 1, 1),datetime.date(2010, 12, 31)]
+    data_df = getts(fileinput, index_col = 'Datahora', indexparse = ['Datahora'], separator = ',', limits = limits)
+    flow = data_df['65019700_cax'].interpolate(limit_direction = 'both').tolist()
+    alpha, bfimax = 0.98, 0.8
+    expected = [bfimax * flow[0]]
+    for i in range(1, len(flow)):
+        b = ((1. - bfimax) * alpha * expected[-1] + (1. - alpha) * bfimax * flow[i]) / (1. - alpha * bfimax)
+        expected.append(min(b, flow[i]))
+    calculated = sep_eckhardt(data_df, ['65019700_cax'], alpha, bfimax)['65019700_cax']
+    msg = """The Eckhardt filter is not working properly. Please contact the Administrator or obtain a stable version"""
+    assert np.allclose(calculated.dropna().values, np.array(expected)[calculated.notnull().values]), msg
+    alpha = 0.925
+    expected = flow
+    for k in range(3):
+        series = expected[::-1] if k % 2 == 1 else expected
+        quick = 0.
+        passed = [series[0]]
+        for i in range(1, len(series)):
+            quick = alpha * quick + (1. + alpha) / 2. * (series[i] - series[i - 1])
+            quick = min(max(quick, 0.), series[i])
+            passed.append(series[i] - quick)
+        expected = passed[::-1] if k % 2 == 1 else passed
+    calculated = sep_lynehollick(data_df, ['65019700_cax'], alpha, 3)['65019700_cax']
+    msg = """The Lyne-Hollick filter is not working properly. Please contact the Administrator or obtain a stable version"""
+    assert np.allclose(calculated.dropna().values, np.array(expected)[calculated.notnull().values]), msg
+    random = np.random.RandomState(0)
+    msg = """The filter recursion is not working properly. Please contact the Administrator or obtain a stable version"""
+    for dates in [1, 2, 3, 10, 99, 1000]:
+        flows = random.lognormal(size = (dates, 4))
+        offsets = random.normal(size = (dates, 4))
+        expected = np.empty((dates, 4))
+        expected[0] = 0.5 * flows[0]
+        for i in range(1, dates):
+            expected[i] = np.minimum(np.maximum(0.9 * expected[i - 1] + offsets[i], 0.), flows[i])
+        calculated = clipped_recursion(0.9, offsets, np.zeros((dates, 4)), flows, 0.5 * flows[0])
+        assert np.allclose(calculated, expected), msg
+
 def print_select_sep():
      ans_print = int(raw_input("""                    
 Would you like an ouput? Type adress or N
@@ -511,6 +1701,139 @@ def launch_sep_straight(ans_select_output, data_df, event_datelist, flowlist):
          sep_straight(data_df, event_datelist, flowlist, output="N")
      elif ans_select_output != "N":
          sep_straight(data_df, event_datelist, flowlist, output=ans_select_output)
+############################   BATCH MODE    #################################################
+# A job file has one job per block of "key = value" lines, blocks being separated by blank lines. Lines starting
+# with # are comments. Keys are the same from Input.txt:
+#   filename       - the file adress, as in file_parser()
+#   header         - the index collumn name, as in header_parser()
+#   limits         - a list with the lower and upper limits, as in limit_parser()
+#   rflist         - a list with rainfall collumn names or numbers
+#   flowlist       - a list with flow collumn names or numbers
+#   event_duration - a list with the start and end of the event, as in event_duration_parser()(runoff only)
+#   action         - print, flaws or runoff(or 1, 2, 3 as in the main menu)
+#   output         - the output figure adress, or N for no file
+# A job takes the values it does not give from the previous job, except for the output. See Input_batch.txt
+
+batch_evaluated = ['limits', 'rflist', 'flowlist', 'event_duration']
+batch_actions = {'1': 'print', '2': 'flaws', '3': 'runoff'}
+batch_shared_df = None # dataframe shared with a worker process, see batch_worker_init()
+
+def batch_parser(jobfile):
+    """Reads a job file and returns a list of jobs as dicts"""
+    jobs = []
+    current = {}
+    given = False
+    with open(jobfile, 'r') as source:
+        lines = source.read().splitlines() + ['']
+    for line in lines:
+        line = line.strip()
+        if line.startswith('#'):
+            continue
+        if line == '':
+            if given == True:
+                jobs.append(dict(current))
+                current.pop('output', None)
+            given = False
+            continue
+        key, value = line.split('=', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if key in batch_evaluated:
+            value = eval(value)
+        if key == 'action':
+            value = batch_actions.get(value, value)
+        current[key] = value
+        given = True
+    return jobs
+
+def batch_run(jobfile, processes = 1):
+    """Runs all the jobs from a job file without prompts. Each file is fetched only once with all the
+    collumns its jobs need, and every job slices its own limits. Figures are rendered with the Agg backend
+    and closed after each job. With more than one process, the jobs of each file are rendered by a pool of
+    processes that share the file dataframe through shared memory(see batch_share()). Returns a list with
+    the time spent on each job in seconds"""
+    plt.switch_backend('Agg')
+    jobs = batch_parser(jobfile)
+    sources = []
+    for job in jobs:
+        if (job['filename'], job['header']) not in sources:
+            sources.append((job['filename'], job['header']))
+    timing = [None] * len(jobs)
+    for filename, header in sources:
+        timeseries_list = getts_columns(filename, header, ',')
+        numbers = [k for k in range(len(jobs)) if (jobs[k]['filename'], jobs[k]['header']) == (filename, header)]
+        for k in numbers:
+            for key in ['rflist', 'flowlist']:
+                jobs[k][key] = [timeseries_list[name] if isinstance(name, int) else name for name in jobs[k].get(key, [])]
+        columns = []
+        for k in numbers:
+            for name in jobs[k]['rflist'] + jobs[k]['flowlist']:
+                if name not in columns:
+                    columns.append(name)
+        data_df = getts(filename, header, [header], ',', None, columns = columns)
+        if processes == 1:
+            for k in numbers:
+                timing[k] = batch_worker(jobs[k], data_df)
+                print('Job %d(%s) done in %.2f s' % (k + 1, jobs[k]['action'], timing[k]))
+        else:
+            pool = multiprocessing.Pool(processes, initializer = batch_worker_init, initargs = batch_share(data_df))
+            try:
+                results = pool.imap(batch_worker, [jobs[k] for k in numbers])
+                for k in numbers:
+                    timing[k] = next(results)
+                    print('Job %d(%s) done in %.2f s' % (k + 1, jobs[k]['action'], timing[k]))
+            finally:
+                pool.close()
+                pool.join()
+        data_df = None # frees the dataframe before the next file is fetched
+    return timing
+
+def batch_share(data_df):
+    """Copies a dataframe to shared memory blocks, so that rendering processes get it once when they start
+    instead of once per job. Values are shared as float64. Returns the arguments for batch_worker_init()"""
+    values = multiprocessing.RawArray('d', data_df.shape[0] * data_df.shape[1])
+    np.frombuffer(values, dtype = np.float64).reshape(data_df.shape)[:] = data_df.values
+    index = multiprocessing.RawArray('q', data_df.shape[0])
+    np.frombuffer(index, dtype = np.int64)[:] = data_df.index.values.astype('datetime64[ns]').astype(np.int64)
+    return (values, index, list(data_df.columns), data_df.index.name)
+
+def batch_worker_init(values, index, columns, index_name):
+    """Starts a rendering process: sets the Agg backend and builds batch_shared_df on top of the shared memory
+    blocks from batch_share(), without copying them"""
+    global batch_shared_df
+    plt.switch_backend('Agg')
+    dates = pd.DatetimeIndex(np.frombuffer(index, dtype = np.int64).view('datetime64[ns]'), name = index_name)
+    values = np.frombuffer(values, dtype = np.float64).reshape(len(dates), len(columns))
+    batch_shared_df = pd.DataFrame(values, index = dates, columns = columns, copy = False)
+
+def batch_worker(job, data_df = None):
+    """Runs one job on data_df(standard = batch_shared_df) and returns the time spent in seconds"""
+    if data_df is None:
+        data_df = batch_shared_df
+    start = time.time()
+    batch_job(data_df, job)
+    plt.close('all')
+    return time.time() - start
+
+def batch_job(data_df, job):
+    """Runs one job from batch_run() on the dataframe of its file"""
+    limits = job['limits']
+    data_df = data_df.loc['%s'%(limits[0]):'%s'%(limits[1])]
+    output = job.get('output', 'N')
+    if job['action'] == 'print':
+        hsprinter(data_df, job['flowlist'], job['rflist'], output = output, print_tofile = output != 'N')
+    elif job['action'] == 'flaws':
+        missingreport(data_df, job['flowlist'], job['rflist'], output = output, printfig = output != 'N')
+    elif job['action'] == 'runoff':
+        for flow_name in job['flowlist']:
+            flow_output = output
+            if output != 'N' and len(job['flowlist']) > 1:
+                root, extension = os.path.splitext(output)
+                flow_output = '%s_%s%s' % (root, flow_name, extension)
+            sep_straight(data_df, job['event_duration'], flow_name, output = flow_output)
+    else:
+        print('Warning: unknown action %s' % (job['action']))
+
 ############################   MAIN MENU    #################################################  
 def main_menu():
     ans_main = int(raw_input("""
@@ -527,29 +1850,37 @@ Ans[AsRawInteger] : """))
     return ans_main
 ##############################################################################################    
 #  Main
-ans_main = main_menu()
-if ans_main == 1:
-    filename = file_parser()
-    limits = limit_parser(filename)
-    header, indexparser = header_parser()
-    data_df, timeseries_list = df_parser(filename, header, indexparser, limits)
-    rainlist = rf_parser(timeseries_list)
-    flowlist, ans_select_output = fl_parser(timeseries_list,ans_main)
-    print_launcher(data_df,flowlist, rainlist, output = ans_select_output)
-    hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output)
-elif ans_main == 2:
-    filename = file_parser()
-    limits = limit_parser(filename)
-    header, indexparser = header_parser()
-    data_df, timeseries_list = df_parser(filename, header, indexparser, limits)
-    rainlist = rf_parser(timeseries_list)
-    flowlist, ans_select_output = fl_parser(timeseries_list, ans_main)
-    print_launcher_flaws(data_df, flowlist, rainlist,ans_select_output)     
-elif ans_main == 3:
-    filename = file_parser()
-    limits = limit_parser(filename)
-    event_datelist = event_duration_parser()
-    header, indexparser = header_parser()
-    data_df, timeseries_list = df_parser(filename, header, indexparser, limits)
-    flowlist, ans_select_output = fl_parser(timeseries_list, ans_main)
-    launch_sep_straight(ans_select_output, data_df, event_datelist, flowlist)  
\ No newline at end of file
+if __name__ == '__main__' and len(sys.argv) > 2:
+    batch_run(sys.argv[1], processes = int(sys.argv[2]))
+elif __name__ == '__main__' and len(sys.argv) > 1:
+    batch_run(sys.argv[1])
+elif __name__ == '__main__':
+    ans_main = main_menu()
+    if ans_main == 1:
+        filename = file_parser()
+        limits = limit_parser(filename)
+        header, indexparser = header_parser()
+        timeseries_list = columns_parser(filename, header)
+        rainlist = rf_parser(timeseries_list)
+        flowlist, ans_select_output = fl_parser(timeseries_list,ans_main)
+        data_df = selected_parser(filename, header, indexparser, limits, rainlist, flowlist)
+        print_launcher(data_df,flowlist, rainlist, output = ans_select_output)
+        hsprint_postprint(filename,data_df, header, timeseries_list,rainlist,flowlist,ans_select_output, limits)
+    elif ans_main == 2:
+        filename = file_parser()
+        limits = limit_parser(filename)
+        header, indexparser = header_parser()
+        timeseries_list = columns_parser(filename, header)
+        rainlist = rf_parser(timeseries_list)
+        flowlist, ans_select_output = fl_parser(timeseries_list, ans_main)
+        data_df = selected_parser(filename, header, indexparser, limits, rainlist, flowlist)
+        print_launcher_flaws(data_df, flowlist, rainlist,ans_select_output)     
+    elif ans_main == 3:
+        filename = file_parser()
+        limits = limit_parser(filename)
+        event_datelist = event_duration_parser()
+        header, indexparser = header_parser()
+        timeseries_list = columns_parser(filename, header)
+        flowlist, ans_select_output = fl_parser(timeseries_list, ans_main)
+        data_df = df_parser(filename, header, indexparser, limits, columns = [flowlist], chunksize = event_chunksize)[0]
+        launch_sep_straight(ans_select_output, data_df, event_datelist, flowlist)  
\ No newline at end of file
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Period group codes shared by completenessreport() in hidrots_1.4.py and by future_modules/hidrots_get_period.py.
+Seasons and water years are defined here only.
+
+@author: David Bispo Ferreira // Federal University of Parana
+"""
+import numpy as np
+
+hydro_seasons = ['DJF', 'DJF', 'MAM', 'MAM', 'MAM', 'JJA', 'JJA', 'JJA', 'SON', 'SON', 'SON', 'DJF'] # season of each month
+wateryear_start = 10 # first month of the water year. The water year is named after the year it ends in
+
+def period_codes(index, start_month = None):
+    """
+    Returns a dict with one integer group code per value of a DatetimeIndex for each period:
+        year: 2005
+        month: 200503
+        season: 20050 - year*10 + the season position in hydro_seasons. December is counted in the season of
+        the following year
+        wateryear: 2006 - the year the water year ends in(see wateryear_start)
+        all: 0
+    The codes are computed once and can be used for every grouping of dataframes sharing the same index. These
+    are the codes of completenessreport() in hidrots_1.4.py and of the period engine in
+    future_modules/hidrots_get_period.py. start_month is the first month of the water year(standard = wateryear_start)
+    """
+    if start_month is None:
+        start_month = wateryear_start
+    years = np.asarray(index.year)
+    months = np.asarray(index.month)
+    season_names = sorted(set(hydro_seasons), key = hydro_seasons.index)
+    season_codes = np.array([season_names.index(name) for name in hydro_seasons])[months - 1]
+    return {'year': years,
+            'month': years * 100 + months,
+            'season': (years + (months == 12)) * 10 + season_codes,
+            'wateryear': years + (months >= start_month) * (start_month > 1),
+            'all': np.zeros(len(years), dtype = int)}
+
+def period_labels(period, codes):
+    """Returns the labels of period_codes() group codes, i.e.: '2005', '2005-03', '2005-DJF', '2006' or 'all'"""
+    season_names = sorted(set(hydro_seasons), key = hydro_seasons.index)
+    if period == 'month':
+        return ['%d-%02d' % (code // 100, code % 100) for code in codes]
+    if period == 'season':
+        return ['%d-%s' % (code // 10, season_names[code % 10]) for code in codes]
+    if period == 'all':
+        return ['all' for code in codes]
+    return ['%d' % code for code in codes]